@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# Headless benchmark: Loads a mod and renders a camera path for a number of frames without opening a visible window, then reports performance as JSON
+# Usage: bench.py <mod> [--frames N] [--path file.json] [--output file.json], the mod name must come first as it's read by the data script
+# The path file is a JSON list of camera poses of the form [pos_x, pos_y, pos_z, rot_x, rot_y, rot_z] with rotation in degrees, poses are played in order and repeated if there are fewer than frames
+# Without a path the camera stays at the player's camera position and turns a full circle around the vertical axis
+# With --pack the renderer isn't used, instead the voxels of every sprite in the scene are split into chunks which are packed into boxes and timed
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from lib import *
+
+import numpy as np
+import argparse
+import json
+import random
+import time
+
+import data
+import init
+
+# Parse the options that follow the mod name
+parser = argparse.ArgumentParser(prog = "bench.py", description = "Headless renderer benchmark")
+parser.add_argument("mod", help = "name of the mod to load")
+parser.add_argument("--frames", type = int, default = 100, help = "number of frames to render")
+parser.add_argument("--path", default = None, help = "JSON file containing the camera path")
+parser.add_argument("--output", default = None, help = "write the results to this JSON file instead of printing them")
+parser.add_argument("--pack", action = "store_true", help = "benchmark packing the voxels of sprites instead of rendering")
+args = parser.parse_args()
+
+# Write the results to the output file or print them, latencies are in milliseconds
+def report(results: dict, summary: str):
+	if args.output:
+		with open(args.output, "wt") as file:
+			json.dump(results, file, indent = 4)
+		print(summary)
+	else:
+		print(json.dumps(results, indent = 4))
+
+# Pack benchmark: Split the first frame of each sprite into chunks and pack every chunk into a new frame, each sprite is packed once per frame count
+if args.pack:
+	sprites = []
+	for obj in data.objects.values():
+		if obj.sprite and not obj.get_sprite() in sprites:
+			sprites.append(obj.get_sprite())
+	results = {"mod": data.mod, "frames": args.frames, "chunk_size": data.settings.chunk_size, "sprites": []}
+	for spr in sprites:
+		chunks = {}
+		for post, mat in spr.frames[0].get_voxels().items():
+			post_chunk = post[0] // data.settings.chunk_size, post[1] // data.settings.chunk_size, post[2] // data.settings.chunk_size
+			if not post_chunk in chunks:
+				chunks[post_chunk] = {}
+			chunks[post_chunk][post] = mat
+		times_pack = []
+		for frame in range(args.frames):
+			boxes = points = 0
+			time_start = time.perf_counter()
+			for voxels in chunks.values():
+				frm = data.Frame(packed = True)
+				frm.data3 = dict(voxels)
+				frm.pack()
+				boxes += len(frm.data6)
+				points += len(frm.data3)
+			times_pack.append(time.perf_counter() - time_start)
+		results["sprites"].append({
+			"size": spr.size.array(),
+			"voxels": sum(len(voxels) for voxels in chunks.values()),
+			"chunks": len(chunks),
+			"boxes": boxes,
+			"points": points,
+			"pack_ms": {
+				"mean": float(np.mean(times_pack) * 1000),
+				"p50": float(np.percentile(times_pack, 50) * 1000),
+				"max": float(np.max(times_pack) * 1000),
+			},
+		})
+	report(results, "Benchmark finished: " + str(round(sum(spr["pack_ms"]["p50"] for spr in results["sprites"]), 2)) + " ms to pack all sprites")
+	exit()
+
+# Seed random numbers so physics and noise behave the same on every run, then create a headless window which renders every frame in this process
+random.seed(0)
+window = init.Window(headless = True)
+if args.path:
+	with open(args.path, "rt") as file:
+		path = [(vec3(pose[0], pose[1], pose[2]), vec3(pose[3], pose[4], pose[5])) for pose in json.load(file)]
+else:
+	path = [(data.player.cam_pos, data.player.rot + vec3(0, 360 * frame / args.frames, 0)) for frame in range(args.frames)]
+
+# Each frame updates the chunks, traces every work unit and updates objects in the same order as the window, chunk updates and tracing are timed separately
+times_chunks = []
+times_frame = []
+stats = counters()
+units = list(range(data.settings.units))
+for frame in range(args.frames):
+	pos, rot = path[frame % len(path)]
+	window.cam.pos = pos
+	window.cam.rot = rot.quaternion()
+
+	time_start = time.perf_counter()
+	window.chunk_update(data.settings.chunk_time)
+	times_chunks.append(time.perf_counter() - time_start)
+
+	time_start = time.perf_counter()
+	image, traversed, thread, units, costs, stats_tile = window.cam.tile(0, units)
+	times_frame.append(time.perf_counter() - time_start)
+	window.traversed = [traversed]
+	if data.stats:
+		stats.merge(stats_tile)
+		stats.merge(data.stats.reset())
+
+	for obj in data.objects.values():
+		obj.update(window.cam.pos)
+	window.physics_update(1 / data.settings.tick)
+
+# Report the results
+time_total = sum(times_frame)
+results = {
+	"mod": data.mod,
+	"frames": args.frames,
+	"path": args.path,
+	"settings": {name: getattr(data.settings, name) for name in ("width", "height", "samples", "batch", "dda", "culling", "chunk_size", "chunk_lod", "dist_max", "max_bounces")},
+	"rays": window.cam.rays,
+	"steps": window.cam.steps,
+	"rays_per_second": window.cam.rays / time_total if time_total else 0,
+	"steps_per_second": window.cam.steps / time_total if time_total else 0,
+	"frame_ms": {
+		"mean": float(np.mean(times_frame) * 1000),
+		"p50": float(np.percentile(times_frame, 50) * 1000),
+		"p90": float(np.percentile(times_frame, 90) * 1000),
+		"p99": float(np.percentile(times_frame, 99) * 1000),
+		"max": float(np.max(times_frame) * 1000),
+	},
+	"chunk_update_ms": {
+		"mean": float(np.mean(times_chunks) * 1000),
+		"p50": float(np.percentile(times_chunks, 50) * 1000),
+		"p99": float(np.percentile(times_chunks, 99) * 1000),
+		"max": float(np.max(times_chunks) * 1000),
+	},
+	"stats": stats.items if data.stats else None,
+}
+report(results, "Benchmark finished: " + str(round(results["rays_per_second"])) + " rays/s, " + str(round(results["frame_ms"]["p50"], 2)) + " ms per frame")
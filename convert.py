@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# Sprite converter: Converts voxel models exported by Goxel as text (.txt or .txt.gz) to the binary sprite format (.vxb) which loads without parsing
+# Usage: convert.py <file> [<file> ...] [--output file.vxb], each file is written next to the original with the .vxb extension unless an output is given for a single file
+# Sprites also convert binary sprites automatically when loading them if the text sprite with the same name is newer, the convert function is used by both
+# Lines that aren't valid voxels are skipped the same way as when loading text sprites, positions are stored as exported and converted by the sprite when loading
+import numpy as np
+import argparse
+import gzip
+import os
+
+# Binary sprite format, all values are little-endian:
+# Header: The magic bytes VOXB followed by the version, palette size and voxel count as 32 bit integers
+# Palette: The RGB hex string of each color padded to 8 bytes
+# Voxels: The X, Y, Z positions and palette indexes of all voxels as four separate arrays of 16 bit integers
+# Color ids must be ASCII strings of at most 8 characters and positions must fit in a signed 16 bit integer, a ValueError is raised for sprites that can't be stored
+# The output is written under another name first so a partial file is never loaded, returns the number of voxels and colors
+def convert(file: str, output: str):
+	match file.split(".")[-1]:
+		case "txt":
+			data = open(file, "rt")
+		case "gz":
+			data = gzip.open(file, "rt")
+		case _:
+			raise ValueError("Cannot convert sprite " + file + ", only .txt and .txt.gz files are supported.")
+
+	palette = {}
+	voxels = []
+	with data:
+		for line in data.readlines():
+			params = line.strip().split(" ")
+			if len(params) >= 4 and params[0].isdigit() and params[1].isdigit() and params[2].isdigit():
+				if not params[3] in palette:
+					if len(params[3]) > 8 or not params[3].isascii():
+						raise ValueError("Cannot convert sprite " + file + ", color id " + params[3] + " isn't an ASCII string of at most 8 characters.")
+					if len(palette) >= 2 ** 15:
+						raise ValueError("Cannot convert sprite " + file + ", it has more than " + str(2 ** 15) + " colors.")
+					palette[params[3]] = len(palette)
+				x, y, z = int(params[0]), int(params[1]), int(params[2])
+				if max(x, y, z) >= 2 ** 15:
+					raise ValueError("Cannot convert sprite " + file + ", position " + str(x) + " " + str(y) + " " + str(z) + " is larger than " + str(2 ** 15 - 1) + ".")
+				voxels.append((x, y, z, palette[params[3]]))
+
+	header = np.array([int.from_bytes(b"VOXB", "little"), 1, len(palette), len(voxels)], dtype = "<u4")
+	colors = np.array([color.encode("ascii") for color in palette], dtype = "S8")
+	arrays = np.array(voxels, dtype = "<i2").reshape(-1, 4).T
+	with open(output + "." + str(os.getpid()), "wb") as out:
+		out.write(header.tobytes() + colors.tobytes() + arrays.tobytes())
+	os.replace(output + "." + str(os.getpid()), output)
+	return len(voxels), len(palette)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(prog = "convert.py", description = "Convert Goxel text sprites to binary sprites")
+	parser.add_argument("files", nargs = "+", help = "text sprites to convert")
+	parser.add_argument("--output", default = None, help = "output file when converting a single sprite")
+	args = parser.parse_args()
+	for file in args.files:
+		output = args.output if args.output and len(args.files) == 1 else file.removesuffix(".gz").removesuffix(".txt") + ".vxb"
+		voxels, colors = convert(file, output)
+		print("Converted " + file + " to " + output + ": " + str(voxels) + " voxels, " + str(colors) + " colors")
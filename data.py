@@ -1,15 +1,22 @@
 #!/usr/bin/python3
 from lib import *
+import convert
 import multiprocessing as mp
 
 import configparser
 import importlib
+import os
+import array
 import gzip
+import hashlib
+import collections
 import copy
+import weakref
 import math
 import random
 
 import pygame as pg
+import numpy as np
 
 # Fetch the mod name and load the config from the mod path
 mod = sys.argv[1].strip() if len(sys.argv) > 1 else "default"
@@ -22,8 +29,14 @@ settings = store(
 	subsamples = cfg.getfloat("WINDOW", "subsamples") or 0,
 	smooth = cfg.getfloat("WINDOW", "smooth") or 0,
 	fps = cfg.getint("WINDOW", "fps") or 0,
+	stats = cfg.getboolean("WINDOW", "stats") or False,
+	stats_file = cfg.get("WINDOW", "stats_file") or "",
+	cache = cfg.get("WINDOW", "cache") or "",
 
 	sync = cfg.getboolean("RENDER", "sync") or False,
+	batch = cfg.getboolean("RENDER", "batch") or False,
+	dda = cfg.getboolean("RENDER", "dda") or False,
+	shared = cfg.getboolean("RENDER", "shared") or False,
 	culling = cfg.getboolean("RENDER", "culling") or False,
 	static = cfg.getboolean("RENDER", "static") or False,
 	samples = cfg.getint("RENDER", "samples") or 1,
@@ -48,6 +61,7 @@ settings = store(
 	lod_random = cfg.getfloat("RENDER", "lod_random") or 0,
 	lod_edge = cfg.getfloat("RENDER", "lod_edge") or 0,
 	threads = cfg.getint("RENDER", "threads") or mp.cpu_count(),
+	balance = cfg.getint("RENDER", "balance") or 0,
 
 	gravity = cfg.getfloat("PHYSICS", "gravity") or 0,
 	friction = cfg.getfloat("PHYSICS", "friction") or 0,
@@ -60,6 +74,8 @@ settings = store(
 	max_pitch = cfg.getint("PHYSICS", "max_pitch") or 0,
 	max_roll = cfg.getint("PHYSICS", "max_roll") or 0,
 	dist_move = cfg.getint("PHYSICS", "dist_move") or 0,
+	tick = cfg.getint("PHYSICS", "tick") or 1,
+	tick_max = cfg.getint("PHYSICS", "tick_max") or 1,
 )
 settings.window = settings.width, settings.height
 settings.window_scaled = settings.window[0] * settings.scale, settings.window[1] * settings.scale
@@ -67,32 +83,76 @@ settings.proportions = ((settings.width + settings.height) / 2) / max(settings.w
 settings.chunk_time = settings.chunk_rate / 1000
 settings.chunk_radius = round(settings.chunk_size / 2)
 
-# Obtain the (x, y) pixel positions for all pixels in the canvas and assign them to the appropriate thread for rendering
+# Obtain the (x, y) pixel positions for all pixels in the canvas and split them into work units which are assigned to threads for rendering
+# Each thread starts with an equal share of units, if balancing is enabled there are multiple units per thread which are redistributed based on their cost
+settings.units = settings.threads * max(1, settings.balance)
 settings.pixels = []
-for t in range(settings.threads):
+for u in range(settings.units):
 	settings.pixels.append([])
 for x in range(settings.width):
 	for y in range(settings.height):
-		t = (x ^ y) % settings.threads
-		settings.pixels[t].append((x, y))
+		u = (x ^ y) % settings.units
+		settings.pixels[u].append((x, y))
 
 # Variables for global instances such as objects and chunk updates, accessed by the window and camera
 objects = {}
+objects_grid = boxgrid(size = settings.chunk_size)
 player = None
 background = None
 
+# Instrumentation counters are only created if enabled, code that measures performance checks if they exist before adding to them
+stats = counters() if settings.stats else None
+
+# The scene cache is only created if a directory is set, sprites and renderer chunks check if it exists before using it
+cache_scene = cache(path = settings.cache) if settings.cache else None
+
+# Materials of this process indexed by [id], entries are removed once nothing else uses the material
+materials = weakref.WeakValueDictionary()
+
+# Get a material received from another process, if a material with this id is already known its properties are replaced in place and the existing instance is returned
+# Render workers thus keep a single copy of each material shared by all chunks using it, sending a material again is enough to update it
+def material_receive(mat_id: int, properties: dict):
+	mat = materials.get(mat_id)
+	if mat is None:
+		mat = Material.__new__(Material)
+		materials[mat_id] = mat
+	vars(mat).clear()
+	vars(mat).update(properties)
+	return mat
+
 # Material: A subset of Frame, used to store the physical properties of a virtual atom
+# Each material has a unique id so render workers can update their copies of it when its properties change
 class Material:
+	ids = 0
+
 	def __init__(self, **settings):
+		Material.ids += 1
+		self.id = Material.ids
 		self.function = settings["function"] if  "function" in settings else None
 		for s in settings:
 			setattr(self, s, settings[s])
+		materials[self.id] = self
+
+	# Materials are pickled as their id and properties, see material_receive
+	def __reduce__(self):
+		return material_receive, (self.id, vars(self))
+
+	# Deep copies get a new id, this includes the materials of copied sprites and objects so they can be edited independently
+	def __deepcopy__(self, memo: dict):
+		mat = Material.__new__(Material)
+		memo[id(self)] = mat
+		for name, value in vars(self).items():
+			setattr(mat, name, copy.deepcopy(value, memo))
+		Material.ids += 1
+		mat.id = Material.ids
+		materials[mat.id] = mat
+		return mat
 
 	# Create a copy of this material that can be edited independently
 	def copy(self):
 		return copy.deepcopy(self)
 
-# Frame: A subset of Sprite, also used by camera chunks to store render data, stores instances of Material to describe a single 3D model
+# Frame: A subset of Sprite, stores instances of Material to describe a single 3D model
 class Frame:
 	def __init__(self, **settings):
 		# If voxel compression is enabled, describe full areas as their min / max corners instead of storing every voxel individually
@@ -105,25 +165,85 @@ class Frame:
 		self.data3 = {}
 		self.data6 = {}
 
+		# If the frame was loaded from a file and not modified since, source holds the key describing its content and the list of materials in its palette
+		self.source = None
+
+		# Totals describing the voxels of the frame, updated when voxels are set so they never need to be expanded
+		# materials is indexed by [material] and counts its voxels at the frame's LOD, bounds holds the min and max corners of all voxels in the same format as data6 or None if they need to be found again
+		self.materials = {}
+		self.bounds = None
+
 	# Clear all voxels from the frame
 	def clear(self):
 		self.data3 = {}
 		self.data6 = {}
+		self.source = None
+		self.materials = {}
+		self.bounds = None
+
+	# Update the totals of the frame after the voxel at this position changed from the old material to the new one, either can be None
+	# Bounds are extended when a voxel is added, removing a voxel at the edge clears them so they're found again when needed
+	def set_totals(self, post3: tuple, mat_old: Material, mat: Material):
+		if mat_old:
+			self.materials[mat_old] -= 1
+			if not self.materials[mat_old]:
+				del self.materials[mat_old]
+			if self.bounds and (post3[0] in (self.bounds[0], self.bounds[3]) or post3[1] in (self.bounds[1], self.bounds[4]) or post3[2] in (self.bounds[2], self.bounds[5])):
+				self.bounds = None
+		if mat:
+			if self.bounds:
+				self.bounds = min(self.bounds[0], post3[0]), min(self.bounds[1], post3[1]), min(self.bounds[2], post3[2]), max(self.bounds[3], post3[0]), max(self.bounds[4], post3[1]), max(self.bounds[5], post3[2])
+			elif not self.materials:
+				self.bounds = post3 + post3
+			self.materials[mat] = self.materials.get(mat, 0) + 1
+
+	# Count the voxels of each material from the points and boxes of the frame, used when the data was replaced at once
+	def set_materials(self):
+		self.materials = dict(collections.Counter(self.data3.values()))
+		self.bounds = None
+		for post6, mat in self.data6.items():
+			self.materials[mat] = self.materials.get(mat, 0) + (post6[3] - post6[0] + 1) * (post6[4] - post6[1] + 1) * (post6[5] - post6[2] + 1)
+
+	# Get the number of voxels in the frame
+	def get_count(self):
+		return sum(self.materials.values()) * self.resolution ** 3
+
+	# Get the total weight of all voxels in the frame, the current weight of each material is used so changes to materials apply
+	def get_weight(self):
+		weight = 0
+		for mat, count in self.materials.items():
+			weight += mat.weight * count
+		return weight * self.resolution ** 3
+
+	# Get the min and max corners of all voxels in the same format as data6, returns None if the frame is empty
+	# Bounds are found from the points and boxes of the frame if a removed voxel cleared them, positions are scaled from the frame's LOD
+	def get_bounds(self):
+		if not self.bounds and self.materials:
+			posts = list(self.data3) + [post6[0:3] for post6 in self.data6] + [post6[3:6] for post6 in self.data6]
+			x, y, z = zip(*posts)
+			self.bounds = min(x), min(y), min(z), max(x), max(y), max(z)
+		if not self.bounds:
+			return None
+		res = self.resolution
+		return self.bounds[0] * res, self.bounds[1] * res, self.bounds[2] * res, self.bounds[3] * res + res - 1, self.bounds[4] * res + res - 1, self.bounds[5] * res + res - 1
 
 	# Mix the voxels of another frame into this frame
 	def mix(self, other, force: bool):
 		voxels = other.get_voxels()
 		self.set_voxels(voxels, force)
 
-	# Get all voxels from the frame
+	# Get all voxels from the frame, points in data3 are copied directly if the frame isn't stored at a lower resolution
 	def get_voxels(self):
-		voxels = {}
-		for post3, mat in self.data3.items():
-			for x in range(post3[0] * self.resolution, post3[0] * self.resolution + self.resolution):
-				for y in range(post3[1] * self.resolution, post3[1] * self.resolution + self.resolution):
-					for z in range(post3[2] * self.resolution, post3[2] * self.resolution + self.resolution):
-						post = x, y, z
-						voxels[post] = mat
+		if self.resolution <= 1:
+			voxels = dict(self.data3)
+		else:
+			voxels = {}
+			for post3, mat in self.data3.items():
+				for x in range(post3[0] * self.resolution, post3[0] * self.resolution + self.resolution):
+					for y in range(post3[1] * self.resolution, post3[1] * self.resolution + self.resolution):
+						for z in range(post3[2] * self.resolution, post3[2] * self.resolution + self.resolution):
+							post = x, y, z
+							voxels[post] = mat
 		for post6, mat in self.data6.items():
 			for x in range(post6[0] * self.resolution, post6[3] * self.resolution + self.resolution):
 				for y in range(post6[1] * self.resolution, post6[4] * self.resolution + self.resolution):
@@ -152,30 +272,67 @@ class Frame:
 			if force or not self.get_voxel(pos):
 				post3 = pos.tuple()
 				self.unpack(pos)
+				self.set_totals(post3, self.data3.get(post3), mat)
 				if mat:
 					self.data3[post3] = mat
 				else:
 					del self.data3[post3]
 				self.pack()
+				self.source = None
 
 	# Set a list of voxels provided in the same format as data3
 	# Unpack the affected area since its content will be changed, ignore positions that aren't valid at the frame's LOD
+	# Boxes overlapping the area of the new voxels are indexed by position once, only boxes containing a voxel that changes are unpacked and the frame is packed again after all voxels were set
 	def set_voxels(self, voxels: dict, force: bool):
-		for post, mat in voxels.items():
-			if self.resolution <= 1 or (not post[0] % self.resolution and not post[1] % self.resolution and not post[2] % self.resolution):
-				pos = vec3(post[0], post[1], post[2])
-				if force or not self.get_voxel(pos):
-					pos = pos // self.resolution if self.resolution > 1 else pos
-					post3 = pos.tuple()
-					self.unpack(pos)
-					if mat:
-						self.data3[post3] = mat
-					else:
-						del self.data3[post3]
+		self.source = None
+		res = self.resolution
+		if res <= 1:
+			changes = voxels
+		else:
+			changes = {}
+			for post, mat in voxels.items():
+				if not post[0] % res and not post[1] % res and not post[2] % res:
+					changes[(post[0] // res, post[1] // res, post[2] // res)] = mat
+		if not changes:
+			return
+
+		# Index the positions of boxes that overlap the area of the new voxels, limited to the part of each box inside that area
+		boxes = {}
+		if self.data6:
+			x, y, z = zip(*changes)
+			x_min, y_min, z_min, x_max, y_max, z_max = min(x), min(y), min(z), max(x), max(y), max(z)
+			for post6 in self.data6:
+				if post6[0] <= x_max and post6[3] >= x_min and post6[1] <= y_max and post6[4] >= y_min and post6[2] <= z_max and post6[5] >= z_min:
+					for x in range(max(post6[0], x_min), min(post6[3], x_max) + 1):
+						for y in range(max(post6[1], y_min), min(post6[4], y_max) + 1):
+							for z in range(max(post6[2], z_min), min(post6[5], z_max) + 1):
+								boxes[(x, y, z)] = post6
+
+		# Existing voxels are only replaced if forced, unpack the boxes containing voxels that change then write the voxels to data3
+		if not force:
+			changes = {post3: mat for post3, mat in changes.items() if not post3 in self.data3 and not post3 in boxes}
+		for post6 in set(boxes[post3] for post3 in changes if post3 in boxes):
+			mat = self.data6.pop(post6)
+			for x in range(post6[0], post6[3] + 1):
+				for y in range(post6[1], post6[4] + 1):
+					for z in range(post6[2], post6[5] + 1):
+						self.data3[(x, y, z)] = mat
+		# Totals are counted once after filling an empty frame, otherwise they're updated for each voxel
+		empty = not self.data3 and not self.data6
+		for post3, mat in changes.items():
+			if not empty:
+				self.set_totals(post3, self.data3.get(post3), mat)
+			if mat:
+				self.data3[post3] = mat
+			elif post3 in self.data3:
+				del self.data3[post3]
+		if empty:
+			self.set_materials()
 		self.pack()
 
 	# Decompress boxes in data6 to points in data3, position determines which box was touched and needs to be unpacked
 	def unpack(self, pos: vec3):
+		time_start = stats.start() if stats else 0
 		for post6, mat in dict(self.data6).items():
 			if pos.x >= post6[0] and pos.x <= post6[3] and pos.y >= post6[1] and pos.y <= post6[4] and pos.z >= post6[2] and pos.z <= post6[5]:
 				for x in range(post6[0], post6[3] + 1):
@@ -185,69 +342,265 @@ class Frame:
 							self.data3[post3] = mat
 				del self.data6[post6]
 				break
+		if stats:
+			stats.stop("time_unpack", time_start)
 
-	# Compress points in data3 to boxes in data6
-	# Search size increases by one unit on each axis as long as voxels of the same material fill each slice being checked
-	# Start scanning from the first valid voxel found, the search area expands from a line to a plane to a cube in order -X, +X, -Y, +Y, -Z, +Z
+	# Compress points in data3 to boxes in data6 with a single sweep
+	# Voxels are joined into runs of the same material along X, runs covering the same X range in consecutive rows are joined into rectangles along Y, rectangles covering the same area in consecutive slices are joined into boxes along Z
+	# Areas larger than a point are removed from data3 and defined as boxes in data6, single voxels remain in data3
 	def pack(self):
-		pack = self.packed
-		while pack:
-			pack = False
-			for post3, mat in self.data3.items():
-				pos_min = pos_max = vec3(post3[0], post3[1], post3[2])
-				i = 0
-				while i < 6:
-					pos = post6 = None
-					pos_i = i
-					match pos_i:
-						case 0:
-							pos = vec3(-1, 0, 0)
-							post6 = pos_min.x - 1, pos_min.y + 0, pos_min.z + 0, pos_min.x + 0, pos_max.y + 0, pos_max.z + 0
-						case 1:
-							pos = vec3(+1, 0, 0)
-							post6 = pos_max.x + 0, pos_min.y + 0, pos_min.z + 0, pos_max.x + 1, pos_max.y + 0, pos_max.z + 0
-						case 2:
-							pos = vec3(0, -1, 0)
-							post6 = pos_min.x + 0, pos_min.y - 1, pos_min.z + 0, pos_max.x + 0, pos_min.y + 0, pos_max.z + 0
-						case 3:
-							pos = vec3(0, +1, 0)
-							post6 = pos_min.x + 0, pos_max.y + 0, pos_min.z + 0, pos_max.x + 0, pos_max.y + 1, pos_max.z + 0
-						case 4:
-							pos = vec3(0, 0, -1)
-							post6 = pos_min.x + 0, pos_min.y + 0, pos_min.z - 1, pos_max.x + 0, pos_max.y + 0, pos_min.z + 0
-						case 5:
-							pos = vec3(0, 0, +1)
-							post6 = pos_min.x + 0, pos_min.y + 0, pos_max.z + 0, pos_max.x + 0, pos_max.y + 0, pos_max.z + 1
-					for x in range(post6[0], post6[3] + 1):
-						for y in range(post6[1], post6[4] + 1):
-							for z in range(post6[2], post6[5] + 1):
-								post = x, y, z
-								if not post in self.data3 or self.data3[post] != mat:
-									i += 1
-								if i != pos_i:
-									break
-							if i != pos_i:
-								break
-						if i != pos_i:
-							break
-					if i == pos_i:
-						if pos.x < 0 or pos.y < 0 or pos.z < 0:
-							pos_min += pos
-						else:
-							pos_max += pos
-
-				# If an area larger than a point exists, remove single voxels from data3 and define them as boxes in data6
-				# The contents of data3 will be modified and are no longer valid this turn, stop the current search and tell the main loop to run again
-				if pos_min.x < pos_max.x or pos_min.y < pos_max.y or pos_min.z < pos_max.z:
-					for x in range(pos_min.x, pos_max.x + 1):
-						for y in range(pos_min.y, pos_max.y + 1):
-							for z in range(pos_min.z, pos_max.z + 1):
-								post = x, y, z
-								del self.data3[post]
-					post6 = pos_min.tuple() + pos_max.tuple()
-					self.data6[post6] = mat
-					pack = True
-					break
+		if not self.packed or not self.data3:
+			return
+		time_start = stats.start() if stats else 0
+
+		# Runs: A voxel starts a run if the voxel before it on X has another material, the run extends on X while the next voxel has the same material
+		# Rows are indexed by [(z, y)] and store a list of runs as (x_min, x_max, material)
+		rows = {}
+		for post3, mat in self.data3.items():
+			x, y, z = post3
+			if self.data3.get((x - 1, y, z)) != mat:
+				x_max = x
+				while self.data3.get((x_max + 1, y, z)) == mat:
+					x_max += 1
+				rows.setdefault((z, y), []).append((x, x_max, mat))
+
+		# Rectangles and boxes: Join runs along Y within each slice, then join rectangles along Z
+		# Slices are indexed by [(0, z)] and store a list of rectangles as (x_min, x_max, y_min, y_max, material)
+		# Every voxel is part of exactly one box, data3 is rebuilt from the boxes that only contain a single voxel
+		slices = {}
+		for z, (x_min, x_max, mat), y_min, y_max in spans(rows):
+			slices.setdefault((0, z), []).append((x_min, x_max, y_min, y_max, mat))
+		self.data3 = {}
+		for _, (x_min, x_max, y_min, y_max, mat), z_min, z_max in spans(slices):
+			if x_min < x_max or y_min < y_max or z_min < z_max:
+				self.data6[(x_min, y_min, z_min, x_max, y_max, z_max)] = mat
+			else:
+				self.data3[(x_min, y_min, z_min)] = mat
+		if stats:
+			stats.stop("time_pack", time_start)
+
+	# Export the voxels of the frame for the scene cache, materials are stored as the index of the first identical material in the given list
+	# Returns None if the frame contains a material that isn't in the list
+	def cache_get(self, mats: list):
+		index = {}
+		for i, mat in enumerate(mats):
+			index.setdefault(id(mat), i)
+		result = []
+		for data, length in ((self.data3, 3), (self.data6, 6)):
+			if not all(id(mat) in index for mat in data.values()):
+				return None
+			posts = np.array(list(data.keys()), dtype = np.int32).reshape(-1, length)
+			result.append((posts, np.array([index[id(mat)] for mat in data.values()], dtype = np.uint16)))
+		return result
+
+	# Import voxels exported by cache_get, the list of materials must describe the same palette
+	def cache_set(self, cache: list, mats: list):
+		(posts3, index3), (posts6, index6) = cache
+		self.data3 = dict(zip(zip(*posts3.T.tolist()), [mats[i] for i in index3.tolist()]))
+		self.data6 = dict(zip(zip(*posts6.T.tolist()), [mats[i] for i in index6.tolist()]))
+		self.set_materials()
+
+# Chunk: A subset of Frame used by renderer chunks, stores voxels in a dense array covering the cubic area of the chunk instead of dictionaries
+# Each cell holds the index of a material in the palette of this chunk with 0 representing empty space, lookups are done by offset instead of searching boxes
+# Cells are stored as unsigned bytes and widened to 16 bits once the palette holds more than 255 materials
+# Cells are also grouped in bricks of 4 x 4 x 4 which count the voxels they contain, allowing rays to skip empty bricks in a single step
+# Each empty brick also knows its distance to the nearest occupied brick, rays can safely skip the whole empty area around it
+# Chunks don't inherit from Frame as they hold none of its data, they provide the same functions used to get set and cache voxels
+class Chunk:
+	def __init__(self, **settings):
+		# pos is the minimum corner of the chunk in world space and size the length of each side, cells are interpreted at the resolution of the chunk
+		self.resolution = settings["resolution"] if "resolution" in settings else 1
+		self.pos = settings["pos"] if "pos" in settings else vec3(0, 0, 0)
+		self.size = settings["size"] if "size" in settings else 0
+		self.clear()
+
+	# Clear all voxels from the chunk
+	def clear(self):
+		self.mins = self.pos // self.resolution
+		self.maxs = (self.pos + self.size - 1) // self.resolution
+		self.cells = self.maxs - self.mins + 1
+		self.data = array.array("B", bytes(self.cells.x * self.cells.y * self.cells.z))
+		self.palette = [None]
+		self.palette_index = {}
+		self.brick = 4
+		self.bricks_cells = (self.cells + self.brick - 1) // self.brick
+		self.bricks = array.array("B", bytes(self.bricks_cells.x * self.bricks_cells.y * self.bricks_cells.z))
+		self.bricks_dist = None
+
+	# Get the offset of the cell at this position in the data array, returns -1 if the position is outside of the chunk
+	def get_cell(self, pos: vec3):
+		x = pos.x - self.mins.x
+		y = pos.y - self.mins.y
+		z = pos.z - self.mins.z
+		if x < 0 or x >= self.cells.x or y < 0 or y >= self.cells.y or z < 0 or z >= self.cells.z:
+			return -1
+		return (x * self.cells.y + y) * self.cells.z + z
+
+	# Get the palette index of a material, new materials are added to the palette and the array is widened when the palette no longer fits in a byte
+	def get_index(self, mat: Material):
+		if not mat:
+			return 0
+		if not id(mat) in self.palette_index:
+			self.palette_index[id(mat)] = len(self.palette)
+			self.palette.append(mat)
+			if len(self.palette) > 256 and self.data.typecode == "B":
+				self.data = array.array("H", self.data)
+		return self.palette_index[id(mat)]
+
+	# Get all voxels from the chunk
+	def get_voxels(self):
+		voxels = {}
+		for i in range(len(self.data)):
+			if self.data[i]:
+				mat = self.palette[self.data[i]]
+				x = (i // (self.cells.y * self.cells.z) + self.mins.x) * self.resolution
+				y = (i // self.cells.z % self.cells.y + self.mins.y) * self.resolution
+				z = (i % self.cells.z + self.mins.z) * self.resolution
+				for post in [(x + rx, y + ry, z + rz) for rx in range(self.resolution) for ry in range(self.resolution) for rz in range(self.resolution)]:
+					voxels[post] = mat
+		return voxels
+
+	# Get the voxel at this position from the chunk, positions outside of the chunk are empty
+	def get_voxel(self, pos: vec3):
+		pos = pos // self.resolution if self.resolution > 1 else pos
+		i = self.get_cell(pos)
+		return self.palette[self.data[i]] if i >= 0 else None
+
+	# Calculate the distance from each brick to the nearest occupied brick, 0 for occupied bricks and 1 for empty bricks next to an occupied one
+	# Distance is measured in bricks along the furthest axis, bricks in a chunk without any voxels can skip the whole chunk
+	def set_bricks_dist(self):
+		bricks = []
+		for x in range(self.bricks_cells.x):
+			for y in range(self.bricks_cells.y):
+				for z in range(self.bricks_cells.z):
+					if self.bricks[(x * self.bricks_cells.y + y) * self.bricks_cells.z + z]:
+						bricks.append((x, y, z))
+
+		dist_max = self.bricks_cells.maxs()
+		self.bricks_dist = array.array("B", bytes(len(self.bricks)))
+		for x in range(self.bricks_cells.x):
+			for y in range(self.bricks_cells.y):
+				for z in range(self.bricks_cells.z):
+					dist = dist_max
+					for post in bricks:
+						dist = min(dist, max(abs(post[0] - x), abs(post[1] - y), abs(post[2] - z)))
+					self.bricks_dist[(x * self.bricks_cells.y + y) * self.bricks_cells.z + z] = dist
+
+	# Get the empty area around the brick containing this position, returns None if the brick holds any voxels or the position is outside of the chunk
+	# The area includes neighboring bricks closer than the nearest occupied brick, it's returned in the same format as data6 with the min and max corners in world space
+	# The area is limited to the chunk since cells of lower LOD chunks may extend past it and voxels in other chunks are unknown
+	def get_brick(self, pos: vec3):
+		x = pos.x // self.resolution - self.mins.x
+		y = pos.y // self.resolution - self.mins.y
+		z = pos.z // self.resolution - self.mins.z
+		if x < 0 or x >= self.cells.x or y < 0 or y >= self.cells.y or z < 0 or z >= self.cells.z:
+			return None
+		x, y, z = x // self.brick, y // self.brick, z // self.brick
+		i = (x * self.bricks_cells.y + y) * self.bricks_cells.z + z
+		if self.bricks[i]:
+			return None
+
+		if not self.bricks_dist:
+			self.set_bricks_dist()
+		dist = self.bricks_dist[i] - 1
+		x_min, y_min, z_min = (self.mins.x + (x - dist) * self.brick) * self.resolution, (self.mins.y + (y - dist) * self.brick) * self.resolution, (self.mins.z + (z - dist) * self.brick) * self.resolution
+		x_max, y_max, z_max = (self.mins.x + (x + dist + 1) * self.brick) * self.resolution, (self.mins.y + (y + dist + 1) * self.brick) * self.resolution, (self.mins.z + (z + dist + 1) * self.brick) * self.resolution
+		return max(self.pos.x, x_min), max(self.pos.y, y_min), max(self.pos.z, z_min), min(self.pos.x + self.size, x_max), min(self.pos.y + self.size, y_max), min(self.pos.z + self.size, z_max)
+
+	# Set a voxel at this position on the chunk, ignore positions that aren't valid at the chunk's LOD
+	def set_voxel(self, pos: vec3, mat: Material, force: bool):
+		self.set_voxels({pos.tuple(): mat}, force)
+
+	# Set a list of voxels provided in the same format as Frame.set_voxels, ignore positions that aren't valid at the chunk's LOD
+	# Offsets are calculated inline as this is called with every voxel of a chunk whenever it's rebuilt
+	def set_voxels(self, voxels: dict, force: bool):
+		res = self.resolution
+		cells, bricks_cells, brick = self.cells, self.bricks_cells, self.brick
+		for post, mat in voxels.items():
+			if res <= 1 or (not post[0] % res and not post[1] % res and not post[2] % res):
+				x, y, z = post[0] // res - self.mins.x, post[1] // res - self.mins.y, post[2] // res - self.mins.z
+				if x < 0 or x >= cells.x or y < 0 or y >= cells.y or z < 0 or z >= cells.z:
+					continue
+				i = (x * cells.y + y) * cells.z + z
+				if force or not self.data[i]:
+					index = self.get_index(mat)
+					if bool(index) != bool(self.data[i]):
+						self.bricks[(x // brick * bricks_cells.y + y // brick) * bricks_cells.z + z // brick] += 1 if index else -1
+						self.bricks_dist = None
+					self.data[i] = index
+
+	# Export the cells of the chunk for the scene cache, palette indexes are replaced with the index of the first identical material in the given list plus one
+	# Returns None if the chunk contains a material that isn't in the list or the list doesn't fit in a byte
+	def cache_get(self, mats: list):
+		if len(mats) > 255 or self.data.typecode != "B":
+			return None
+		index = {}
+		for i, mat in enumerate(mats):
+			index.setdefault(id(mat), i + 1)
+		table = bytearray(256)
+		for i, mat in enumerate(self.palette[1:], 1):
+			if not id(mat) in index:
+				return None
+			table[i] = index[id(mat)]
+		return self.data.tobytes().translate(table), self.bricks.tobytes()
+
+	# Import cells exported by cache_get, the palette is rebuilt from the list of materials which must describe the same palette
+	def cache_set(self, cache: tuple, mats: list):
+		self.palette = [None]
+		self.palette_index = {}
+		table = bytearray(256)
+		for i, mat in enumerate(mats):
+			table[i + 1] = self.get_index(mat)
+		self.data = array.array("B", cache[0].translate(table))
+		self.bricks = array.array("B", cache[1])
+		self.bricks_dist = None
+
+# Tree: A hierarchy of the positions of renderer chunks used to skip empty space at every scale, level 0 nodes are chunks and each level groups 2 x 2 x 2 nodes of the level below
+# Nodes are indexed by [level][position_node] and count the chunks they contain, chunks can be added and removed at any time and only update the nodes containing them
+# Positions are in units of the node size at each level, the area above the top level is considered empty if none of its nodes exist
+class Tree:
+	def __init__(self, **settings):
+		self.size = settings["size"] if "size" in settings else 1
+		self.levels = settings["levels"] if "levels" in settings else 8
+		self.nodes = [{} for level in range(self.levels + 1)]
+
+	# Check whether a chunk exists at this chunk position
+	def get(self, post: tuple):
+		return (post[0] // self.size, post[1] // self.size, post[2] // self.size) in self.nodes[0]
+
+	# Add or remove the chunk at this chunk position, the count of each node containing it is changed once
+	def set(self, post: tuple, active: bool):
+		if self.get(post) == active:
+			return
+		for level in range(self.levels + 1):
+			size = self.size << level
+			post_node = post[0] // size, post[1] // size, post[2] // size
+			nodes = self.nodes[level]
+			nodes[post_node] = nodes.get(post_node, 0) + (1 if active else -1)
+			if not nodes[post_node]:
+				del nodes[post_node]
+
+	# Get the area of the largest empty node containing this position, returns None if the position is inside an existing chunk
+	# The area is returned in the same format as data6 with the min and max corners in world space
+	def get_empty(self, pos: vec3):
+		for level in range(self.levels, -1, -1):
+			size = self.size << level
+			x, y, z = pos.x // size, pos.y // size, pos.z // size
+			if not (x, y, z) in self.nodes[level]:
+				return x * size, y * size, z * size, (x + 1) * size, (y + 1) * size, (z + 1) * size
+		return None
+
+# Parse a block of lines from a text sprite, each line contains the X Y Z position and the RGB hex color of a voxel
+# Returns the position and the index of the color in the given list for every voxel as an array of integers, lines with an invalid position or a color not in the list are skipped
+# Defined outside of sprites so it can be called by a pool of processes
+def parse_text(block: bytes, colors: list):
+	index = {color.encode(): i for i, color in enumerate(colors)}
+	values = array.array("i")
+	for line in block.split(b"\n"):
+		params = line.strip().split(b" ")
+		if len(params) >= 4 and params[0].isdigit() and params[1].isdigit() and params[2].isdigit() and params[3] in index:
+			values.extend((int(params[0]), int(params[1]), int(params[2]), index[params[3]]))
+	return values.tobytes()
 
 # Sprite: A subset of Object, stores multiple instances of Frame which can be animated or transformed to produce an usable 3D image
 class Sprite:
@@ -262,31 +615,149 @@ class Sprite:
 			self.size.z = math.trunc(self.size.z) + 1 if math.trunc(self.size.z) % 2 != 0 else math.trunc(self.size.z)
 
 		# Animation properties and the frame list used to store multiple voxel meshes representing animation frames
+		# Rotated voxels of each frame are cached and indexed by [frame, angle_x, angle_y, angle_z], the cache is cleared when voxels are changed through the sprite
 		self.frame = self.frame_time = self.frame_start = self.frame_end = 0
 		self.frames = []
+		self.cache = {}
 		for i in range(settings["frames"]):
 			self.frames.append(Frame(packed = False, resolution = self.lod + 1))
 
-	# Import from text file, Y and Z are flipped to match the engine's coordinate system
+	# Import from text or binary files, Y and Z are flipped to match the engine's coordinate system
+	# If the scene cache is enabled the voxels of empty frames are stored after loading, they're read from the cache next time if the file sprite size LOD and palette are the same
+	# Frames loaded this way remember their source so renderer chunks built from them can also be cached
+	# Text frames are read together after the others, if a frame can't be opened loading stops there but the text frames before it are still read
 	def load(self, files: list, materials: dict):
+		files = [self.load_file(file) for file in files]
+		colors = sorted(materials)
+		mats = [materials[color] for color in colors]
+		sources = {}
+		frames_text = []
 		for frame in range(min(len(files), len(self.frames))):
-			data = None
+			frm = self.get_frame(frame)
+			source = None
+			if cache_scene and not frm.data3 and not frm.data6 and os.path.isfile(files[frame]):
+				digest = hashlib.sha1()
+				with open(files[frame], "rb") as file:
+					for block in iter(lambda: file.read(2 ** 20), b""):
+						digest.update(block)
+				source = digest.hexdigest(), self.size.tuple(), self.lod, tuple(colors)
+				cached = cache_scene.get(("sprite", files[frame], self.size.tuple(), self.lod), source)
+				if cached:
+					frm.cache_set(cached, mats)
+					frm.source = source, mats
+					continue
+
+			voxels = None
+			sources[frame] = source
 			match files[frame].split(".")[-1]:
-				case "txt":
-					data = open(files[frame], "rt")
-				case "gz":
-					data = gzip.open(files[frame], "rt")
-			if not data:
-				print("Warning: Cannot open sprite " + file + ", make sure the path and extension are correct.")
-				return
-
-			voxels = {}
-			for line in data.readlines():
-				params = line.strip().split(" ")
-				if params[0].isdigit() and params[1].isdigit() and params[2].isdigit() and params[3] in materials:
-					post = self.size.x - int(params[0]), int(params[2]), int(params[1])
-					voxels[post] = materials[params[3]]
-			self.get_frame(frame).set_voxels(voxels, True)
+				case "txt" | "gz":
+					frames_text.append(frame)
+					continue
+				case "vxb":
+					voxels = self.load_binary(files[frame], materials)
+			if voxels is None:
+				print("Warning: Cannot open sprite " + files[frame] + ", make sure the path and extension are correct and the file isn't damaged.")
+				break
+			self.load_frame(frame, files[frame], voxels, sources[frame], mats)
+
+		for frame, voxels in self.load_text(files, frames_text, colors, mats):
+			self.load_frame(frame, files[frame], voxels, sources[frame], mats)
+		self.cache = {}
+
+	# Get the file to load, a binary sprite is converted from the text sprite with the same name if the binary sprite is missing or older
+	# If the binary sprite can't be written or the text sprite can't be stored in the binary format the text sprite is loaded instead
+	def load_file(self, file: str):
+		if file.endswith(".vxb"):
+			for source in (file.removesuffix(".vxb") + ".txt.gz", file.removesuffix(".vxb") + ".txt"):
+				if os.path.isfile(source):
+					if not os.path.isfile(file) or os.path.getmtime(source) > os.path.getmtime(file):
+						try:
+							convert.convert(source, file)
+						except (OSError, ValueError):
+							return source
+					break
+		return file
+
+	# Set the voxels loaded from a file on a frame, frames with a source are stored in the scene cache
+	def load_frame(self, frame: int, file: str, voxels: dict, source: tuple, mats: list):
+		frm = self.get_frame(frame)
+		frm.set_voxels(voxels, True)
+		if source:
+			frm.source = source, mats
+			cache_scene.set(("sprite", file, self.size.tuple(), self.lod), source, frm.cache_get(mats))
+
+	# Read the voxels of text sprites exported by Goxel for the given frames, returns the frame and voxels of each file once it was read
+	# Files are streamed in blocks of lines, if there's more than one block in total they're parsed by a pool of processes while the next blocks are being read
+	# Only a few blocks per process are read ahead of those being parsed so the text of a file is never held in memory at once, voxels are added in the order of their lines
+	def load_text(self, files: list, frames: list, colors: list, mats: list):
+		pool = None
+		queue = collections.deque()
+		voxels = {}
+		try:
+			for frame, block, last in self.load_text_blocks(files, frames):
+				if not pool and (queue or not last):
+					pool = mp.Pool(settings.threads)
+					queue = collections.deque((f, pool.apply_async(parse_text, (b, colors)), l) for f, b, l in queue)
+				queue.append((frame, pool.apply_async(parse_text, (block, colors)) if pool else block, last))
+				while len(queue) > (settings.threads * 2 if pool else 1):
+					frame, result, last = queue.popleft()
+					self.load_text_voxels(voxels, result.get() if pool else parse_text(result, colors), mats)
+					if last:
+						yield frame, voxels
+						voxels = {}
+			while queue:
+				frame, result, last = queue.popleft()
+				self.load_text_voxels(voxels, result.get() if pool else parse_text(result, colors), mats)
+				if last:
+					yield frame, voxels
+					voxels = {}
+		finally:
+			if pool:
+				pool.terminate()
+
+	# Read the files of the given frames in blocks of whole lines, returns the frame of each block and whether it's the last block of that frame
+	def load_text_blocks(self, files: list, frames: list):
+		for frame in frames:
+			with gzip.open(files[frame], "rb") if files[frame].endswith(".gz") else open(files[frame], "rb") as file:
+				rest = b""
+				block = file.read(2 ** 18)
+				while True:
+					block_next = file.read(2 ** 18) if block else b""
+					if block_next:
+						lines, _, rest = (rest + block).rpartition(b"\n")
+					else:
+						lines, rest = rest + block, b""
+					yield frame, lines, not block_next
+					if not block_next:
+						break
+					block = block_next
+
+	# Add voxels parsed by parse_text to a list of voxels, positions are converted to the engine's coordinate system
+	def load_text_voxels(self, voxels: dict, values: bytes, mats: list):
+		values = array.array("i", values)
+		posts = zip([self.size.x - x for x in values[0::4]], values[2::4], values[1::4])
+		voxels.update(zip(posts, [mats[color] for color in values[3::4]]))
+
+	# Read the voxels of a binary sprite created by convert.py, the file is mapped to memory and its arrays are used in place without parsing
+	# The header contains the magic bytes VOXB followed by the version, palette size and voxel count, the palette stores the RGB hex string of each color padded to 8 bytes
+	# Voxels are stored as separate arrays of X, Y, Z positions and palette indexes, positions are converted the same way as text sprites
+	# Returns None if the file is missing, has another format or is shorter than its header describes, voxels with a palette index outside the palette are skipped
+	def load_binary(self, file: str, materials: dict):
+		size = os.path.getsize(file) if os.path.isfile(file) else 0
+		if size < 16:
+			return None
+		buffer = np.memmap(file, dtype = np.uint8, mode = "r")
+		magic, version, palette, count = buffer[:16].view("<u4").tolist()
+		if magic != int.from_bytes(b"VOXB", "little") or version != 1 or size < 16 + palette * 8 + count * 8:
+			return None
+
+		mats = [materials.get(color.decode("ascii", "replace")) for color in buffer[16:16 + palette * 8].view("S8").tolist()]
+		arrays = buffer[16 + palette * 8:16 + palette * 8 + count * 8].view("<i2").reshape(4, count)
+		indexes = np.where((arrays[3] >= 0) & (arrays[3] < palette), arrays[3], palette)
+		valid = np.array([mat is not None for mat in mats] + [False], dtype = bool)[indexes]
+		x, y, z, index = arrays[:, valid]
+		posts = zip((self.size.x - x).tolist(), z.tolist(), y.tolist())
+		return dict(zip(posts, [mats[i] for i in index.tolist()]))
 
 	# Create a copy of this sprite that can be edited independently
 	def copy(self):
@@ -385,6 +856,7 @@ class Sprite:
 			return
 
 		self.get_frame(frame).set_voxel(pos, mat, force)
+		self.cache = {}
 
 	# Set a list of voxels in which each item is a tuple of the form (position, material)
 	def set_voxels(self, frame: int, voxels: list):
@@ -395,6 +867,7 @@ class Sprite:
 				return
 
 		self.get_frame(frame).set_voxels(voxels, force)
+		self.cache = {}
 
 	# Fill the cubic area between min and max corners with the given material
 	def set_voxels_area(self, frame: int, pos_min: vec3, pos_max: vec3, mat: Material, force: bool):
@@ -409,6 +882,7 @@ class Sprite:
 					post = x, y, z
 					voxels[post] = mat
 		self.get_frame(frame).set_voxels(voxels, force)
+		self.cache = {}
 
 	# Get the voxel at this position on the given frame, returns the material or None if empty or out of range
 	# Position is in local space, always convert the position to local coordinates before calling this
@@ -422,9 +896,64 @@ class Sprite:
 	def get_voxels(self, frame: int):
 		return self.get_frame(frame).get_voxels()
 
+	# Return a list of all voxels on the given frame as seen at the desired rotation, positions are in local space and can be offset by the object's minimum corner
+	# The result is cached per frame and rotation so moving objects only need to translate it, it must not be modified
+	def get_voxels_rotated(self, frame: int, rot: vec3):
+		frame = frame if isinstance(frame, int) else self.frame
+		key = frame, round(rot.x / 90) % 4, round(rot.y / 90) % 4, round(rot.z / 90) % 4
+		if not key in self.cache:
+			voxels_frame = self.get_voxels(frame)
+			voxels = {}
+			if key[1:] == (0, 0, 0):
+				for post, mat in voxels_frame.items():
+					if post[0] >= 0 and post[0] < self.size.x and post[1] >= 0 and post[1] < self.size.y and post[2] >= 0 and post[2] < self.size.z:
+						voxels[post] = mat
+			else:
+				for x in range(self.size.x):
+					for y in range(self.size.y):
+						for z in range(self.size.z):
+							post = self.pos_rotated(vec3(x, y, z), rot).tuple()
+							if post in voxels_frame:
+								voxels[(x, y, z)] = voxels_frame[post]
+			self.cache[key] = voxels
+		return self.cache[key]
+
+	# Return the voxels on the given frame as seen at the desired rotation, used by the physics system to find touching voxels without fetching every position
+	# Voxels are grouped by their coordinate on each axis so the layers of a face can be read directly, the solidity of their materials is checked on collision so changes to it apply immediately
+	# Unlike rotated voxels, those one position outside the sprite size are kept as get_voxel returns them and the bounding box of an object can be one voxel larger than its sprite
+	# Returns the material of each voxel indexed by [position] and the positions of voxels indexed by [axis][coordinate], the result is cached with the rotated voxels
+	def get_voxels_solid(self, frame: int, rot: vec3):
+		frame = frame if isinstance(frame, int) else self.frame
+		key = "solid", frame, round(rot.x / 90) % 4, round(rot.y / 90) % 4, round(rot.z / 90) % 4
+		if not key in self.cache:
+			voxels_frame = self.get_voxels(frame)
+			if key[2:] == (0, 0, 0):
+				voxels_rotated = voxels_frame
+			else:
+				voxels_rotated = {}
+				for x in range(-1, self.size.x + 1):
+					for y in range(-1, self.size.y + 1):
+						for z in range(-1, self.size.z + 1):
+							post = self.pos_rotated(vec3(x, y, z), rot).tuple()
+							if post in voxels_frame:
+								voxels_rotated[(x, y, z)] = voxels_frame[post]
+
+			voxels = {}
+			layers = ({}, {}, {})
+			for post, mat in voxels_rotated.items():
+				if mat:
+					voxels[post] = mat
+					for axis in range(3):
+						if not post[axis] in layers[axis]:
+							layers[axis][post[axis]] = []
+						layers[axis][post[axis]].append(post)
+			self.cache[key] = voxels, layers
+		return self.cache[key]
+
 	# Clear all voxels on the given frame
 	def clear(self, frame: int):
 		self.get_frame(frame).clear()
+		self.cache = {}
 
 # Object: The base class for objects in the world, uses up to 4 instances of Sprite representing different rotation angles
 class Object:
@@ -439,8 +968,13 @@ class Object:
 		self.physics = settings["physics"] if "physics" in settings else False
 		self.function = settings["function"] if  "function" in settings else None
 
+		# Physics runs for active objects that aren't sleeping, objects sleep once they rest and are woken when pushed, moved or touched by a moving object
+		# The velocity of a sleeping object is remembered in vel_sleep, an object whose velocity was changed directly is woken by its next physics tick
 		self.id = random.getrandbits(64)
 		self.visible = False
+		self.active = False
+		self.sleeping = False
+		self.vel_sleep = None
 		self.redraw = True
 		self.size = self.mins = self.maxs = vec3(0, 0, 0)
 		self.weight = 0
@@ -450,10 +984,28 @@ class Object:
 		self.cam_rot = quaternion(0, 0, 0, 0)
 		self.move(self.pos)
 		objects[self.id] = self
+		self.set_grid()
 
-	# Disable this object and remove it from the global object list
+	# Disable this object and remove it from the global object list, objects resting on it are woken
 	def remove(self):
+		self.wake()
 		del objects[self.id]
+		objects_grid.set(self.id, None)
+
+	# Store the bounding box of this object in the grid used to find nearby objects, only objects in the global object list are indexed
+	def set_grid(self):
+		if objects.get(self.id) is self:
+			objects_grid.set(self.id, self.mins.tuple() + self.maxs.tuple())
+
+	# Resume physics for this object and any sleeping object touching its bounding box, called when the object moves or changes shape
+	def wake(self):
+		self.sleeping = False
+		pos_min = self.mins - 1
+		pos_max = self.maxs + 1
+		for obj_id in objects_grid.get(pos_min.tuple() + pos_max.tuple()):
+			obj = objects[obj_id]
+			if obj.sleeping and obj.intersects(pos_min, pos_max):
+				obj.sleeping = False
 
 	# Create a copy of this object that can be edited independently
 	def copy(self):
@@ -476,6 +1028,7 @@ class Object:
 			angle_z_new = round(self.rot.z / 90) % 4
 			if angle_x_new != angle_x_old or angle_y_new != angle_y_old or angle_z_new != angle_z_old:
 				self.redraw = True
+				self.wake()
 			self.set_camera_pos()
 
 	# Teleport the object to this origin, use only when necessary and prefer impulse instead
@@ -485,17 +1038,23 @@ class Object:
 			self.mins = math.ceil(self.pos) - self.size
 			self.maxs = math.floor(self.pos) + self.size
 			self.redraw = True
+			self.set_grid()
+			self.wake()
 			self.set_camera_pos()
 
 	# Add velocity to this object, 1 is the maximum speed allowed for objects
+	# The object is woken immediately, velocity set directly wakes it on the next physics tick instead
 	def accelerate(self, vel):
 		self.vel += vel
+		self.sleeping = False
 
 	# Physics engine, applies velocity accounting for collisions with other objects and moves this object to the nearest empty space if one is available
 	def update_physics(self):
 		# Each iteration a move is preformed in the direction of the largest velocity step, the check continues until all velocity steps have been processed
-		self_spr = self.get_sprite()
+		self_voxels, self_layers = self.get_sprite().get_voxels_solid(None, self.rot)
 		friction = elasticity = 0
+		pos_old = self.pos
+		vel_old = vec3(self.vel.x, self.vel.y, self.vel.z)
 		vel_apply = self.vel
 		while vel_apply != 0:
 			vel_dir = math.trunc(vel_apply.normalize())
@@ -515,28 +1074,37 @@ class Object:
 				post6 = self.mins.x + 0, self.mins.y + 0, self.mins.z - 1, self.maxs.x + 0, self.maxs.y + 0, self.mins.z + 0
 			elif vel_dir.z > 0:
 				post6 = self.mins.x + 0, self.mins.y + 0, self.maxs.z + 0, self.maxs.x + 0, self.maxs.y + 0, self.maxs.z + 1
+			axis = 0 if vel_dir.x else 1 if vel_dir.y else 2
+			axis_1, axis_2 = (axis + 1) % 3, (axis + 2) % 3
 
-			# Check all objects that intersect the slice in which self desires to move
-			for obj in objects.values():
+			# Check all objects that intersect the slice in which self desires to move, candidates are the objects in the grid cells touched by the slice in the same order as the global object list
+			for obj_id in objects_grid.get(post6):
+				obj = objects[obj_id]
 				if obj != self and obj.visible and obj.intersects(vec3(post6[0], post6[1], post6[2]), vec3(post6[3], post6[4], post6[5])):
 					# If we're colliding with another physical object, transfer velocity based on weight difference and projectile speed
 					if obj.physics:
 						vel_transfer = vel_apply * max(0, min(1, abs(vel_apply).maxs() * self.weight - obj.weight))
-						obj.vel += vel_transfer
+						obj.accelerate(vel_transfer)
 						self.vel -= vel_transfer
 						vel_apply -= vel_transfer
 
 					# If the slice collides with any solid voxel in the object the move will no longer be preformed this call
 					# The check is also used to update friction and elasticity from voxels that were touched
-					obj_spr = obj.get_sprite()
-					for x in range(post6[0], post6[3] + 1):
-						for y in range(post6[1], post6[4] + 1):
-							for z in range(post6[2], post6[5] + 1):
-								pos = vec3(x, y, z)
-								obj_mat = obj_spr.get_voxel(None, pos - obj.mins, obj.rot)
-								if obj_mat and obj_mat.solidity > random.random():
-									self_mat = self_spr.get_voxel(None, pos - self.mins - vel_dir, self.rot)
-									if self_mat and self_mat.solidity > random.random():
+					# Only voxels of self in the layers that move into the slice are checked, each is compared with the voxel of the object at the same position in the slice
+					# Materials that are always solid collide without drawing a random chance
+					obj_voxels = obj.get_sprite().get_voxels_solid(None, obj.rot)[0]
+					offset = (self.mins + vel_dir).tuple()
+					offset_obj = offset[0] - obj.mins.x, offset[1] - obj.mins.y, offset[2] - obj.mins.z
+					for coord in range(post6[axis] - offset[axis], post6[axis + 3] - offset[axis] + 1):
+						for post in self_layers[axis].get(coord, ()):
+							if post[axis_1] < post6[axis_1] - offset[axis_1] or post[axis_1] > post6[axis_1 + 3] - offset[axis_1] or post[axis_2] < post6[axis_2] - offset[axis_2] or post[axis_2] > post6[axis_2 + 3] - offset[axis_2]:
+								continue
+							post_obj = post[0] + offset_obj[0], post[1] + offset_obj[1], post[2] + offset_obj[2]
+							if post_obj in obj_voxels:
+								obj_mat = obj_voxels[post_obj]
+								if obj_mat.solidity >= 1 or obj_mat.solidity > random.random():
+									self_mat = self_voxels[post]
+									if self_mat.solidity >= 1 or self_mat.solidity > random.random():
 										friction += obj_mat.friction * self_mat.friction * settings.friction
 										elasticity += obj_mat.elasticity * self_mat.elasticity * settings.friction
 										blocked = True
@@ -559,6 +1127,11 @@ class Object:
 		if abs(self.vel.z) < settings.min_velocity:
 			self.vel.z = 0
 
+		# The object is resting if it didn't move and its velocity stopped changing, it sleeps until woken
+		if self.pos == pos_old and max(abs(self.vel.x - vel_old.x), abs(self.vel.y - vel_old.y), abs(self.vel.z - vel_old.z)) <= settings.min_velocity:
+			self.sleeping = True
+			self.vel_sleep = vec3(self.vel.x, self.vel.y, self.vel.z)
+
 	# Update this object, called by the window every frame
 	# An immediate renderer update is issued when the object changes visibility or the sprite animation advances
 	def update(self, pos_cam: vec3):
@@ -571,8 +1144,10 @@ class Object:
 		if visible_old != visible_new:
 			self.redraw = True
 
-		# Update the animation frame and calculate physics based on the new sprite, limited by the physics sleep distance setting
-		if self.visible and dist <= settings.dist_move:
+		# Update the animation frame based on the new sprite and mark the object as active for physics, limited by the physics sleep distance setting
+		# Physics is not calculated here but by the window at a fixed rate, a new animation frame wakes the object as its shape changed
+		self.active = self.visible and dist <= settings.dist_move
+		if self.active:
 			spr = self.get_sprite()
 			frame_old = spr.frame
 			spr.anim_update()
@@ -580,9 +1155,8 @@ class Object:
 			if frame_old != frame_new:
 				self.redraw = True
 				self.set_weight()
+				self.wake()
 
-			if self.physics:
-				self.update_physics()
 			if self.function:
 				self.function(self)
 
@@ -596,6 +1170,8 @@ class Object:
 			self.mins = math.ceil(self.pos) - self.size
 			self.maxs = math.floor(self.pos) + self.size
 		self.redraw = True
+		self.set_grid()
+		self.wake()
 		self.set_weight()
 
 	# Get the sprite assigned to this object
@@ -607,8 +1183,7 @@ class Object:
 	def set_weight(self):
 		self.weight = 0
 		if self.sprite:
-			for mat in self.sprite.get_voxels(None).values():
-				self.weight += mat.weight
+			self.weight = self.sprite.get_frame(None).get_weight()
 
 	# Update the world camera position and rotation coordinates for camera objects
 	def set_camera_pos(self):
@@ -2,20 +2,508 @@
 from lib import *
 
 import multiprocessing as mp
+import multiprocessing.shared_memory
+import numpy as np
 import pygame as pg
+import pickle
+import queue
+import json
+import time
 import math
 import random
 
 import data
 
+# Batch: A subset of Camera used by the batch render engine, stores chunks as dense arrays of material indexes and traces all rays of a tile at once using NumPy
+# Slot 0 of the voxel array is always empty and represents the void, the grid translates chunk positions to the slot holding the voxels of that chunk
+# Each slot also stores which bricks of 4 x 4 x 4 voxels are occupied so rays can cross empty bricks in a single step
+# Nodes of the camera's tree are kept as sorted arrays of encoded positions per level, rays in the void leave the largest empty node containing them at once
+# Rays are advanced together as arrays and removed from the active set once finished, rays hitting materials with a custom function fall back to calling it per ray
+class Batch:
+	def __init__(self):
+		size = data.settings.chunk_size
+		self.voxels = np.zeros((1, size, size, size), dtype = np.uint16)
+		self.bricks = np.zeros((1, -(-size // 4), -(-size // 4), -(-size // 4)), dtype = bool)
+		self.resolution = np.ones(1, dtype = np.int64)
+		self.slots = {}
+		self.slots_free = []
+		self.grid = np.zeros((1, 1, 1), dtype = np.int64)
+		self.grid_min = np.zeros(3, dtype = np.int64)
+		self.grid_update = False
+		self.tree = None
+		self.tree_keys = []
+		self.tree_update = True
+		self.materials = [None]
+		self.materials_index = {}
+		self.materials_count = [0]
+		self.materials_free = []
+		self.materials_changed = False
+		self.slots_materials = {}
+		self.materials_update()
+
+	# Rebuild the property arrays of all known materials, index 0 represents empty space and indexes of materials no longer used are None
+	def materials_update(self):
+		mats = self.materials[1:]
+		self.albedo = np.array([[0, 0, 0]] + [getattr(mat, "albedo", rgb(0, 0, 0)).array() for mat in mats], dtype = np.float64)
+		self.roughness = np.array([0] + [getattr(mat, "roughness", 0) for mat in mats], dtype = np.float64)
+		self.absorption = np.array([0] + [getattr(mat, "absorption", 0) for mat in mats], dtype = np.float64)
+		self.ior = np.array([0] + [getattr(mat, "ior", 0) for mat in mats], dtype = np.float64)
+		self.energy = np.array([0] + [getattr(mat, "energy", 0) for mat in mats], dtype = np.float64)
+		self.builtin = np.array([False] + [getattr(mat, "function", None) is material for mat in mats], dtype = bool)
+		self.materials_changed = False
+
+	# Get the index of a material used by a slot, materials are identified by their id and counted once for every slot using them
+	# Workers keep a single copy of each material which is updated in place, the properties of known materials are only read again by materials_update
+	def material_get(self, mat: data.Material):
+		if not mat.id in self.materials_index:
+			index = self.materials_free.pop() if self.materials_free else len(self.materials)
+			if index == len(self.materials):
+				self.materials.append(None)
+				self.materials_count.append(0)
+			self.materials[index] = mat
+			self.materials_index[mat.id] = index
+			self.materials_changed = True
+		index = self.materials_index[mat.id]
+		self.materials_count[index] += 1
+		return index
+
+	# Release a material index used by a slot, the index is freed once no slot uses it
+	def material_release(self, index: int):
+		self.materials_count[index] -= 1
+		if not self.materials_count[index]:
+			del self.materials_index[self.materials[index].id]
+			self.materials[index] = None
+			self.materials_free.append(index)
+			self.materials_changed = True
+
+	# Add or clear the voxels of a chunk at this position
+	# Materials of the new chunk are counted before those of the old one are released so materials used by both keep their index
+	def chunk_set(self, post: tuple, chunk):
+		indexes = [self.material_get(mat) for mat in chunk.palette[1:]] if chunk else []
+		if post in self.slots:
+			slot = self.slots.pop(post)
+			self.voxels[slot] = 0
+			self.bricks[slot] = False
+			self.slots_free.append(slot)
+			for index in self.slots_materials.pop(slot):
+				self.material_release(index)
+		if chunk:
+			slot = self.slots_free.pop() if self.slots_free else len(self.slots) + 1
+			if slot >= len(self.voxels):
+				self.voxels = np.concatenate((self.voxels, np.zeros_like(self.voxels)))
+				self.bricks = np.concatenate((self.bricks, np.zeros_like(self.bricks)))
+				self.resolution = np.concatenate((self.resolution, np.ones_like(self.resolution)))
+
+			# Translate the palette of the chunk to material indexes, cells of lower LOD chunks are repeated to fill each position
+			palette = np.array([0] + indexes, dtype = np.uint16)
+			cells = np.frombuffer(chunk.data, dtype = np.uint8 if chunk.data.typecode == "B" else np.uint16).reshape(chunk.cells.tuple())
+			pos = np.arange(data.settings.chunk_size)
+			cells_x = (post[0] + pos) // chunk.resolution - chunk.mins.x
+			cells_y = (post[1] + pos) // chunk.resolution - chunk.mins.y
+			cells_z = (post[2] + pos) // chunk.resolution - chunk.mins.z
+			self.voxels[slot] = palette[cells[np.ix_(cells_x, cells_y, cells_z)]]
+
+			# Mark bricks of 4 x 4 x 4 voxels that contain any voxel, the voxels are padded to a multiple of the brick size
+			bricks = self.bricks.shape[1]
+			occupied = np.pad(self.voxels[slot] > 0, (0, bricks * 4 - data.settings.chunk_size))
+			self.bricks[slot] = occupied.reshape(bricks, 4, bricks, 4, bricks, 4).any(axis = (1, 3, 5))
+			self.resolution[slot] = chunk.resolution
+			self.slots[post] = slot
+			self.slots_materials[slot] = indexes
+		if self.materials_changed:
+			self.materials_update()
+		self.grid_update = True
+
+	# Recalculate the grid of chunk positions after chunks were added or removed
+	def grid_set(self):
+		self.grid_update = False
+		if not self.slots:
+			self.grid = np.zeros((1, 1, 1), dtype = np.int64)
+			return
+
+		posts = np.array(list(self.slots.keys()), dtype = np.int64) // data.settings.chunk_size
+		self.grid_min = posts.min(axis = 0)
+		self.grid = np.zeros(posts.max(axis = 0) - self.grid_min + 1, dtype = np.int64)
+		posts -= self.grid_min
+		self.grid[posts[:, 0], posts[:, 1], posts[:, 2]] = list(self.slots.values())
+
+	# Recalculate the arrays of tree node positions after chunk positions were added or removed, positions are encoded the same way as traversed chunks
+	def tree_keys_set(self, tree: data.Tree):
+		self.tree_update = False
+		self.tree = tree
+		self.tree_keys = []
+		for nodes in tree.nodes:
+			posts = np.array(list(nodes.keys()), dtype = np.int64).reshape(-1, 3) + 2 ** 20
+			self.tree_keys.append(np.sort((posts[:, 0] << 42) | (posts[:, 1] << 21) | posts[:, 2]))
+
+	# Get the chunk slots and material indexes at a list of integer positions
+	def get_voxels(self, pos):
+		size = data.settings.chunk_size
+		pos_chunk = pos // size
+		pos_grid = pos_chunk - self.grid_min
+		inside = np.all((pos_grid >= 0) & (pos_grid < self.grid.shape), axis = 1)
+		slots = np.zeros(len(pos), dtype = np.int64)
+		pos_grid = pos_grid[inside]
+		slots[inside] = self.grid[pos_grid[:, 0], pos_grid[:, 1], pos_grid[:, 2]]
+		pos_local = pos - pos_chunk * size
+		return slots, self.voxels[slots, pos_local[:, 0], pos_local[:, 1], pos_local[:, 2]]
+
+	# Get the distance rays at the given indexes need to travel to leave an area, as well as the axis of the face they leave through, equivalent to Camera.area_exit
+	def area_exit(self, ray, i, area_min, area_max):
+		vel = ray.vel[i]
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			dist = np.where(vel > 0, (area_max - ray.pos[i]) / vel, np.where(vel < 0, (area_min - ray.pos[i]) / vel, np.inf))
+		axis = np.argmin(dist, axis = 1)
+		return np.maximum(0, dist[np.arange(len(i)), axis]), axis
+
+	# Get the distance rays at the given indexes need to travel to leave their brick, as well as the axis of the face they leave through
+	# Also returns a mask of the rays whose brick is empty, bricks are limited to the area of their chunk
+	def brick_exit(self, ray, i, pos, slots):
+		pos_local = pos[i] % data.settings.chunk_size
+		empty = ~self.bricks[slots[i], pos_local[:, 0] // 4, pos_local[:, 1] // 4, pos_local[:, 2] // 4]
+		brick_min = pos[i] - pos_local % 4
+		brick_max = brick_min + np.minimum(4, data.settings.chunk_size - (pos_local // 4) * 4)
+		return (empty,) + self.area_exit(ray, i, brick_min, brick_max)
+
+	# Get the distance rays at the given indexes need to travel to leave the largest empty tree node containing the given positions, equivalent to Tree.get_empty
+	# Also returns a mask of the rays that are in an empty node, the others are inside an existing chunk
+	def tree_exit(self, ray, i, pos):
+		level = np.full(len(i), -1)
+		for l in range(self.tree.levels, -1, -1):
+			post = np.floor(pos / (self.tree.size << l)).astype(np.int64) + 2 ** 20
+			found = np.isin((post[:, 0] << 42) | (post[:, 1] << 21) | post[:, 2], self.tree_keys[l])
+			level = np.where((level < 0) & ~found, l, level)
+		empty = level >= 0
+		size = (self.tree.size << np.maximum(0, level))[:, None]
+		area_min = np.floor(pos / size) * size
+		return (empty,) + self.area_exit(ray, i, area_min, area_min + size)
+
+	# Call a custom function for a single ray of the batch, the ray is converted to a data store and its changes are written back to the arrays
+	def trace_custom(self, ray, i: int, mat: data.Material):
+		ray_single = raydata(
+			color = rgb(ray.color[i, 0], ray.color[i, 1], ray.color[i, 2]),
+			energy = ray.energy[i],
+			pos = vec3(ray.pos[i, 0], ray.pos[i, 1], ray.pos[i, 2]),
+			vel = vec3(ray.vel[i, 0], ray.vel[i, 1], ray.vel[i, 2]),
+			step = ray.step[i],
+			life = ray.life[i],
+			bounces = ray.bounces[i],
+			traversed = set(),
+		)
+		result = mat.function(ray_single, mat, data.settings) if mat else data.background(ray_single, data.settings)
+		ray.color[i] = ray_single.color.array()
+		ray.energy[i] = ray_single.energy
+		ray.pos[i] = ray_single.pos.array()
+		ray.vel[i] = ray_single.vel.array()
+		ray.step[i] = ray_single.step
+		ray.life[i] = ray_single.life
+		ray.bounces[i] = ray_single.bounces
+		return result
+
+	# Store the chunks touched by a list of positions, chunk positions are encoded as a single integer so duplicates can be removed quickly
+	# When stats are enabled the chunk of each ray is remembered so entering a new chunk can be counted
+	def traverse(self, ray, active, pos, traversed: list):
+		pos_chunk = pos // data.settings.chunk_size + 2 ** 20
+		keys = (pos_chunk[:, 0] << 42) | (pos_chunk[:, 1] << 21) | pos_chunk[:, 2]
+		traversed.append(np.unique(keys))
+		if data.stats:
+			data.stats.add("chunks", int((keys != ray.chunk[active]).sum()))
+			ray.chunk[active] = keys
+
+	# Call the material function for the rays at the given indexes which hit a voxel, equivalent to Camera.hit
+	# Returns a mask of the rays that reached one of their limits and should stop
+	def hit(self, ray, hits, slots, mats, rng):
+		hits_mat = mats[hits]
+		bounce = np.zeros(len(hits))
+		if data.stats:
+			data.stats.add("hits", len(hits))
+			data.stats.add("custom", int((~self.builtin[hits_mat]).sum()))
+
+		# Builtin material: Same operations as lib.material applied to every ray that hit such a voxel
+		builtin = self.builtin[hits_mat]
+		if builtin.any():
+			i = hits[builtin]
+			m = hits_mat[builtin]
+			absorption = np.minimum(1, self.absorption[m] / ((1 + ray.bounces[i]) ** (1 + data.settings.falloff)))
+			ray.color[i] = np.round(ray.color[i] * (1 - absorption)[:, None] + self.albedo[m] * absorption[:, None])
+			ray.energy[i] = ray.energy[i] * (1 - absorption) + self.energy[m] * absorption
+			ray.life[i] *= 1 - self.roughness[m] * absorption
+			ray.vel[i] += (-1 + rng.random((len(i), 3)) * 2) * self.roughness[m][:, None]
+			bounce[builtin] = self.absorption[m]
+		if not builtin.all():
+			for h in np.nonzero(~builtin)[0]:
+				bounce[h] = self.trace_custom(ray, hits[h], self.materials[hits_mat[h]])
+
+		# Add the bounces, shorten ray life based on chunk LOD, normalize velocity and stop rays that reached their limits
+		ray.bounces[hits] += bounce
+		ray.life[hits] /= self.resolution[slots[hits]] + bounce * data.settings.lod_bounces
+		ref = np.abs(ray.vel[hits]).max(axis = 1)
+		ray.vel[hits] /= np.where(ref, ref, 1)[:, None]
+		return (ray.step[hits] >= ray.life[hits]) | (ray.energy[hits] >= data.settings.max_light) | (ray.bounces[hits] >= data.settings.max_bounces + 1)
+
+	# Advance all active rays by one step, equivalent to Camera.march
+	# Rays that stop after hitting a material are marked as finished
+	def march(self, ray, finished, rng, traversed: list):
+		active = ~finished
+		pos = np.floor(ray.pos).astype(np.int64)
+		slots, mats = self.get_voxels(pos)
+		self.traverse(ray, active, pos[active], traversed)
+
+		hits = np.nonzero((mats > 0) & active)[0]
+		if len(hits):
+			stop = self.hit(ray, hits, slots, mats, rng)
+			finished[hits[stop]] = True
+
+			# Reflect the velocity of the ray based on material IOR and the neighbor of this voxel on each axis
+			reflect = hits[~stop]
+			reflect_ior = self.ior[mats[reflect]]
+			reflect = reflect[reflect_ior != 0]
+			reflect_ior = reflect_ior[reflect_ior != 0]
+			if len(reflect):
+				direction = (reflect_ior - 0.5) * 2
+				for axis in range(3):
+					neighbor = np.array(ray.pos[reflect])
+					neighbor[:, axis] += np.where(ray.vel[reflect, axis] < direction, 1, -1)
+					neighbor_mats = self.get_voxels(np.floor(neighbor).astype(np.int64))[1]
+					neighbor_solid = (neighbor_mats > 0) & (self.ior[neighbor_mats] == reflect_ior)
+					ray.vel[reflect, axis] -= np.where(neighbor_solid, 0, ray.vel[reflect, axis] * reflect_ior * 2)
+
+		# Advance rays that are still active, move by frame LOD if inside a valid chunk or leave the largest empty node of the tree if void
+		# Rays in an empty brick of their chunk skip to the edge of the brick while moving at least as far as a normal step
+		# Chunks that exist but were culled from the camera are crossed toward the safest possible distance to the nearest chunk so they can be traversed
+		active = ~finished
+		step = np.where(slots > 0, self.resolution[slots], 1 + np.abs(data.settings.chunk_radius - (ray.pos.min(axis = 1) + data.settings.chunk_radius) % data.settings.chunk_size))
+		skip = np.nonzero(active & (slots > 0) & (mats == 0))[0]
+		if len(skip):
+			empty, dist, axis = self.brick_exit(ray, skip, pos, slots)
+			step[skip[empty]] = np.maximum(step[skip[empty]], dist[empty])
+			if data.stats:
+				data.stats.add("bricks", int(empty.sum()))
+		void = np.nonzero(active & (slots == 0))[0]
+		if len(void):
+			if data.stats:
+				data.stats.add("voids", len(void))
+			empty, dist, axis = self.tree_exit(ray, void, ray.pos[void])
+			step[void[empty]] = dist[empty] + 0.001
+		ray.step[active] += step[active]
+		ray.pos[active] += ray.vel[active] * step[active][:, None]
+
+	# Calculate the distance to the next face and the distance between faces on each axis for the rays at the given indexes, equivalent to Camera.dda
+	def dda(self, ray, i):
+		vel = ray.vel[i]
+		unit = ray.unit[i][:, None]
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			face = np.where(vel > 0, ray.cell[i] + 1, ray.cell[i]) * unit
+			ray.t_max[i] = np.where(vel != 0, np.maximum(0, (face - ray.pos[i]) / vel), np.inf)
+			ray.t_delta[i] = np.where(vel != 0, unit / np.abs(vel), np.inf)
+
+	# Advance all active rays to their next cell, equivalent to Camera.march_dda
+	# Rays whose traversal was reset start again from their position, rays stopped by a material or unable to move are marked as finished
+	def march_dda(self, ray, finished, rng, traversed: list):
+		active = ~finished
+		start = np.nonzero(active & (ray.unit == 0))[0]
+		if len(start):
+			pos = ray.pos[start] + ray.vel[start] * 0.001
+			slots = self.get_voxels(np.floor(pos).astype(np.int64))[0]
+			ray.unit[start] = np.where(slots > 0, self.resolution[slots], 1)
+			ray.cell[start] = np.floor(pos / ray.unit[start][:, None]).astype(np.int64)
+			ray.axis[start] = -1
+			ray.mat_prev[start] = 0
+			self.dda(ray, start)
+
+		# Fetch the cell of each ray, restart the traversal of rays entering a chunk with another resolution and skip rays in the void
+		pos = ray.cell * ray.unit[:, None]
+		slots, mats = self.get_voxels(pos)
+		self.traverse(ray, active, pos[active], traversed)
+		restart = active & (slots > 0) & (self.resolution[slots] != ray.unit) & (ray.axis >= 0)
+		void = active & (slots == 0)
+		ray.unit[restart | void] = 0
+		if void.any():
+			i = np.nonzero(void)[0]
+			if data.stats:
+				data.stats.add("voids", len(i))
+			step = 1 + np.abs(data.settings.chunk_radius - (ray.pos[i].min(axis = 1) + data.settings.chunk_radius) % data.settings.chunk_size)
+			empty, dist, axis = self.tree_exit(ray, i, ray.pos[i] + ray.vel[i] * 0.001)
+			step[empty] = dist[empty]
+			ray.step[void] += step
+			ray.pos[void] += ray.vel[void] * step[:, None]
+
+		# Rays in a cell of an empty brick move to the edge of the brick at once and continue from the cell entered through the face they left by
+		cells = active & ~restart & ~void
+		skip = np.nonzero(cells & (mats == 0))[0]
+		if len(skip):
+			empty, dist, axis = self.brick_exit(ray, skip, pos, slots)
+			skip, dist, axis = skip[empty], dist[empty], axis[empty]
+			if data.stats:
+				data.stats.add("bricks", len(skip))
+			stuck = np.isinf(dist)
+			finished[skip[stuck]] = True
+			cells[skip] = False
+			skip, dist, axis = skip[~stuck], dist[~stuck], axis[~stuck]
+			ray.step[skip] += dist
+			ray.pos[skip] += ray.vel[skip] * dist[:, None]
+			ray.cell[skip] = np.floor((ray.pos[skip] + ray.vel[skip] * 0.001) / ray.unit[skip][:, None]).astype(np.int64)
+			ray.axis[skip] = axis
+			ray.mat_prev[skip] = 0
+			self.dda(ray, skip)
+
+		# Call the material of rays that hit a voxel, reflect the velocity on the axis of the face the ray entered through unless the previous cell has the same IOR
+		hits = np.nonzero(cells & (mats > 0))[0]
+		if len(hits):
+			stop = self.hit(ray, hits, slots, mats, rng)
+			finished[hits[stop]] = True
+			cells[hits[stop]] = False
+			reflect = hits[~stop]
+			reflect_ior = self.ior[mats[reflect]]
+			reflect_prev = ray.mat_prev[reflect]
+			reflect_mask = (reflect_ior != 0) & (ray.axis[reflect] >= 0) & ((reflect_prev == 0) | (self.ior[reflect_prev] != reflect_ior))
+			reflect = reflect[reflect_mask]
+			axis = ray.axis[reflect]
+			ray.vel[reflect, axis] -= ray.vel[reflect, axis] * reflect_ior[reflect_mask] * 2
+			self.dda(ray, hits[~stop])
+		ray.mat_prev = np.where(cells, mats, ray.mat_prev)
+
+		# Advance the rays to the nearest face and enter the next cell on that axis
+		i = np.nonzero(cells)[0]
+		axis = np.argmin(ray.t_max[i], axis = 1)
+		step = ray.t_max[i, axis]
+		stuck = np.isinf(step)
+		finished[i[stuck]] = True
+		i, axis, step = i[~stuck], axis[~stuck], step[~stuck]
+		ray.axis[i] = axis
+		ray.step[i] += step
+		ray.pos[i] += ray.vel[i] * step[:, None]
+		ray.t_max[i] -= step[:, None]
+		ray.t_max[i, axis] += ray.t_delta[i, axis]
+		ray.cell[i, axis] += np.where(ray.vel[i, axis] > 0, 1, -1)
+
+	# Trace a list of rays from the camera, equivalent to calling Camera.trace for each direction and detail
+	# Returns the color, energy and step count of each ray as well as the positions of chunks traveled through
+	def trace(self, cam, dir_x, dir_y, detail, rng):
+		if self.grid_update:
+			self.grid_set()
+		if self.tree_update:
+			self.tree_keys_set(cam.tree)
+
+		# Calculate the direction of every ray, the lens quaternion is created from an euler rotation with no X axis and multiplied with the camera rotation
+		count = len(dir_x)
+		rand_dof = (-1 + rng.random((2, count)) * 2) * data.settings.dof
+		lens_x = np.radians(-((dir_x / data.settings.proportions) * cam.lens + rand_dof[0])) / 2
+		lens_y = np.radians((dir_y * data.settings.proportions) * cam.lens + rand_dof[1]) / 2
+		lens_qx = -np.sin(lens_x) * np.sin(lens_y)
+		lens_qy = np.sin(lens_x) * np.cos(lens_y)
+		lens_qz = np.cos(lens_x) * np.sin(lens_y)
+		lens_qw = np.cos(lens_x) * np.cos(lens_y)
+		rot = cam.rot
+		qx = rot.w * lens_qx + rot.z * lens_qy - rot.y * lens_qz + rot.x * lens_qw
+		qy = rot.z * lens_qx + rot.w * lens_qy + rot.x * lens_qz + rot.y * lens_qw
+		qz = rot.y * lens_qx - rot.x * lens_qy + rot.w * lens_qz + rot.z * lens_qw
+		qw = rot.x * lens_qx - rot.y * lens_qy - rot.z * lens_qz + rot.w * lens_qw
+		ray_dir = np.stack((2 * (qz * qx + qw * qy), 2 * (qy * qx - qw * qz), 1 - 2 * (qz ** 2 + qy ** 2)), axis = 1)
+
+		# Ray data is stored as arrays with one item per active ray, the final state of each ray is written to the result arrays by id when it finishes
+		# The DDA traversal mode keeps its own arrays for the cell of each ray, a unit of 0 means the traversal needs to be started
+		ray = store(
+			color = np.zeros((count, 3)),
+			energy = np.zeros(count),
+			pos = np.array(cam.pos.array(), dtype = np.float64) + ray_dir * data.settings.dist_min,
+			vel = ray_dir,
+			step = np.zeros(count),
+			life = (data.settings.dist_max - data.settings.dist_min) * detail,
+			bounces = np.zeros(count),
+		)
+		result = store(**{name: np.array(value) for name, value in vars(ray).items()})
+		ray.id = np.arange(count)
+		if data.settings.dda:
+			ray.unit = np.zeros(count, dtype = np.int64)
+			ray.cell = np.zeros((count, 3), dtype = np.int64)
+			ray.t_max = np.zeros((count, 3))
+			ray.t_delta = np.zeros((count, 3))
+			ray.axis = np.full(count, -1)
+			ray.mat_prev = np.zeros(count, dtype = np.uint16)
+		if data.stats:
+			ray.chunk = np.full(count, -1, dtype = np.int64)
+		traversed = []
+
+		# Advance the rays until all of them finished, store the state of finished rays and remove them from the active arrays
+		# The number of steps each ray was advanced for is counted to estimate the cost of each pixel
+		steps = np.zeros(count, dtype = np.int64)
+		while len(ray.id):
+			steps[ray.id] += 1
+			finished = ray.step >= ray.life
+			if data.settings.dda:
+				self.march_dda(ray, finished, rng, traversed)
+			else:
+				self.march(ray, finished, rng, traversed)
+
+			if finished.any():
+				for name in vars(result):
+					getattr(result, name)[ray.id[finished]] = getattr(ray, name)[finished]
+				for name in vars(ray):
+					setattr(ray, name, getattr(ray, name)[~finished])
+
+		# Run the background function, the builtin background is applied to all rays at once
+		if data.background is material_background:
+			absorption = np.minimum(1, 1 / ((1 + result.bounces) ** (1 + data.settings.falloff)))
+			vel_y = np.maximum(0, result.vel[:, 1])
+			color = np.stack((np.full(count, 127), 127 + vel_y * 64, 127 + vel_y * 128), axis = 1)
+			result.color = np.round(result.color * (1 - absorption)[:, None] + color * absorption[:, None])
+			result.energy = result.energy * (1 - absorption) + (1 + vel_y) * absorption
+			result.color = np.minimum(255, np.round(result.color * result.energy[:, None]))
+		elif data.background:
+			for i in range(count):
+				self.trace_custom(result, i, None)
+
+		# Decode the positions of traversed chunks from the keys collected during each step
+		keys = np.unique(np.concatenate(traversed)) if traversed else np.zeros(0, dtype = np.int64)
+		pos_chunk = (np.stack((keys >> 42, (keys >> 21) & (2 ** 21 - 1), keys & (2 ** 21 - 1)), axis = 1) - 2 ** 20) * data.settings.chunk_size
+		return result.color, result.energy, steps, [tuple(post) for post in pos_chunk.tolist()]
+
+	# Draw a tile using the batch engine, all samples of every pixel in the given work units are traced together
+	# Also returns the share of the work done for each unit, estimated from the number of steps its rays were advanced for
+	# If static noise is enabled the random generator is seeded by the units so the noise pattern stays the same between frames while the thread keeps them
+	def tile(self, cam, units: list):
+		rng = np.random.default_rng(units if data.settings.static else None)
+		pixels = np.concatenate([np.array(data.settings.pixels[u], dtype = np.int64).reshape(-1, 2) for u in units])
+		pixels_unit = np.repeat(np.arange(len(units)), [len(data.settings.pixels[u]) for u in units])
+		dir_x = -1 + (pixels[:, 0] / data.settings.width) * 2
+		dir_y = -1 + (pixels[:, 1] / data.settings.height) * 2
+		detail = 1 - np.abs(dir_x * dir_y) * data.settings.lod_edge
+		samples = np.maximum(1, np.round(data.settings.samples * detail)).astype(np.int64)
+
+		# Repeat each pixel once per sample, the sample number of each ray is its index within the pixel
+		pixel = np.repeat(np.arange(len(pixels)), samples)
+		sample = np.arange(len(pixel)) - np.repeat(np.cumsum(samples) - samples, samples)
+		ray_detail = detail[pixel] / (1 + sample * data.settings.lod_samples) * (1 - data.settings.lod_random * rng.random(len(pixel)))
+		color, energy, steps, traversed = self.trace(cam, dir_x[pixel], dir_y[pixel], ray_detail, rng)
+		alpha = np.round(np.minimum(1, energy + data.settings.shutter) * 255)
+		costs = np.bincount(pixels_unit[pixel], weights = steps, minlength = len(units)) / max(1, steps.sum())
+		cam.rays += len(pixel)
+		cam.steps += int(steps.sum())
+
+		# Average the samples of each pixel and pack them in the order of the units and their pixels
+		colors = np.zeros((len(pixels), 4))
+		np.add.at(colors, pixel, np.concatenate((color, alpha[:, None]), axis = 1))
+		colors /= samples[:, None]
+		if cam.framebuffer is not None:
+			cam.framebuffer[pixels[:, 1], pixels[:, 0]] = colors
+			return None, traversed, costs.tolist()
+		image = colors.astype(np.uint8).tobytes()
+		return image, traversed, costs.tolist()
+
 # Camera: A subset of Window which only stores data needed for rendering and is used by threads, preforms ray tracing and draws tiles which are overlayed to the canvas by the main thread
 # Camera rotation is stored as quaternion rather than euler to facilitate rolling and calculating the perspective of light rays
+# The camera counts the rays it traced and the steps they preformed, used to measure performance by the benchmark
 class Camera:
 	def __init__(self):
 		self.pos = vec3(0, 0, 0)
 		self.rot = quaternion(0, 0, 0, 0)
 		self.lens = data.settings.fov * math.pi / 8
 		self.chunks = {}
+		self.tree = data.Tree(size = data.settings.chunk_size)
+		self.batch = None
+		self.framebuffer = None
+		self.rays = self.steps = 0
 
 	# Add or clear a camera chunk frame at this position
 	def chunk_set(self, post: tuple, chunk):
@@ -23,6 +511,50 @@ class Camera:
 			self.chunks[post] = chunk
 		elif post in self.chunks:
 			del self.chunks[post]
+		if self.batch:
+			self.batch.chunk_set(post, chunk)
+
+	# Add or remove a chunk position from the tree used to skip empty space, the tree includes chunks the camera doesn't have so culled chunks can still be traversed
+	def tree_set(self, post: tuple, active: bool):
+		self.tree.set(post, active)
+		if self.batch:
+			self.batch.tree_update = True
+
+	# Main loop of a render worker, each process keeps its own copy of the camera and chunks for the lifetime of the window
+	# Counters inherited from the main process are cleared so they aren't returned with the first tile and counted twice
+	# If the shared framebuffer is enabled its name is provided and the worker attaches to it, rows are indexed by [y][x] and store RGBA colors
+	# Messages are pickled once by the main thread: Chunk and tree changes are applied to the local copies, a draw request provides the camera pose and the work units of every thread then traces a new tile
+	# Received materials replace the properties of the worker's existing copy when unpickled, materials whose properties changed are sent alone so existing chunks don't need to be sent again
+	def work(self, thread: int, pipe, results, framebuffer: str):
+		if data.stats:
+			data.stats.reset()
+		if framebuffer:
+			framebuffer_memory = mp.shared_memory.SharedMemory(name = framebuffer)
+			self.framebuffer = np.ndarray((data.settings.height, data.settings.width, 4), dtype = np.uint8, buffer = framebuffer_memory.buf)
+		if data.settings.batch:
+			self.batch = Batch()
+		while True:
+			msg = pickle.loads(pipe.recv_bytes())
+			match msg[0]:
+				case "chunks":
+					for post_chunk, chunk in msg[1].items():
+						self.chunk_set(post_chunk, chunk)
+					if self.batch:
+						self.batch.materials_update()
+				case "materials":
+					if self.batch:
+						self.batch.materials_update()
+				case "tree":
+					for post_chunk, active in msg[1].items():
+						self.tree_set(post_chunk, active)
+				case "draw":
+					self.pos, self.rot, self.lens = msg[1], msg[2], msg[3]
+					results.put(self.tile(thread, msg[4][thread]))
+				case "exit":
+					if framebuffer:
+						self.framebuffer = None
+						framebuffer_memory.close()
+					return
 
 	# Get the frame of the chunk touched by this position if one exists
 	def chunk_get(self, pos: vec3):
@@ -43,11 +575,9 @@ class Camera:
 		lens = vec3(0, -lens_x, +lens_y)
 		ray_rot = self.rot.multiply(lens.quaternion())
 		ray_dir = ray_rot.vec_forward()
-		chunk_min = chunk_max = vec3(0, 0, 0)
-		chunk = None
 
-		# Ray data is kept in a data store so it can be easily delivered to material functions and support custom properties
-		ray = store(
+		# Ray data is kept in a slotted ray object so it can be easily delivered to material functions and support custom properties
+		ray = raydata(
 			color = rgb(0, 0, 0),
 			energy = 0,
 			pos = self.pos + ray_dir * data.settings.dist_min,
@@ -55,34 +585,74 @@ class Camera:
 			step = 0,
 			life = (data.settings.dist_max - data.settings.dist_min) * detail,
 			bounces = 0,
-			traversed = [],
+			traversed = set(),
 		)
 
-		# Each step the ray advances through space by adding the velocity to its position, starting from the minimum distance and going until its lifetime runs out or it's stopped earlier
-		# Chunk data is calculated first to reflect the chunk the ray is currently in, the active chunk is changed when the ray enters the area of another chunk
-		# If a material is found, its function is called which can modify any of the ray properties, performance optimizations may terminate the ray sooner
-		# Note that diagonal steps are allowed and the ray can penetrate 1 voxel thick corners, checking in a stair pattern isn't supported due to performance
-		# The ray also returns the positions of chunks it traveled through which is used for occlusion culling
+		# Advance the ray through the chunks using the desired traversal mode, count the ray and its steps
+		self.rays += 1
+		if data.settings.dda:
+			self.steps += self.march_dda(ray)
+		else:
+			self.steps += self.march(ray)
+
+		# Run the background function and return the ray data
+		if data.background:
+			data.background(ray, data.settings)
+		return ray
+
+	# Call the material function of a voxel hit by the ray and obtain the bounce amount, add it to the total number of bounces
+	# The builtin material is applied directly using the same operations as lib.material on plain numbers, other material functions are called for each hit
+	# Normalize ray velocity after any changes to ensure the speed of light remains 1 and voxels aren't skipped or calculated twice
+	# Returns True if the ray reached one of its limits and should stop
+	def hit(self, ray, mat: data.Material, chunk: data.Chunk):
+		if mat.function is material:
+			bounce = mat.absorption
+			absorption = min(1, bounce / ((1 + ray.bounces) ** (1 + data.settings.falloff)))
+			keep = 1 - absorption
+			color = ray.color
+			albedo = mat.albedo
+			ray.color = rgb(round(color.r * keep + albedo.r * absorption), round(color.g * keep + albedo.g * absorption), round(color.b * keep + albedo.b * absorption))
+			ray.energy = ray.energy * keep + mat.energy * absorption
+			ray.life *= 1 - mat.roughness * absorption
+			vel = ray.vel
+			if mat.roughness:
+				roughness = mat.roughness
+				vel = vec3(vel.x + (-1 + random.random() * 2) * roughness, vel.y + (-1 + random.random() * 2) * roughness, vel.z + (-1 + random.random() * 2) * roughness)
+		else:
+			bounce = mat.function(ray, mat, data.settings)
+			vel = ray.vel
+		ray.bounces += bounce
+		ray.life /= chunk.resolution + bounce * data.settings.lod_bounces
+		ray.vel = vel.normalize()
+		return ray.step >= ray.life or ray.energy >= data.settings.max_light or ray.bounces >= data.settings.max_bounces + 1
+
+	# Each step the ray advances through space by adding the velocity to its position, starting from the minimum distance and going until its lifetime runs out or it's stopped earlier
+	# Chunk data is calculated first to reflect the chunk the ray is currently in, the active chunk is changed when the ray enters the area of another chunk
+	# If a material is found, its function is called which can modify any of the ray properties, performance optimizations may terminate the ray sooner
+	# Note that diagonal steps are allowed and the ray can penetrate 1 voxel thick corners, checking in a stair pattern isn't supported due to performance
+	# The ray also returns the positions of chunks it traveled through which is used for occlusion culling, the number of steps preformed is returned
+	# Counters are kept in local variables and added to the stats once the ray finished
+	def march(self, ray):
+		chunk_min = chunk_max = vec3(0, 0, 0)
+		chunk = None
+		steps = chunks = voids = bricks = hits = custom = 0
 		while ray.step < ray.life:
-			if not ray.pos >= chunk_min or not ray.pos <= chunk_max:
+			steps += 1
+			if not ray.pos.within(chunk_min, chunk_max):
 				chunk_min = ray.pos.snapped(data.settings.chunk_size)
 				chunk_max = chunk_min + data.settings.chunk_size
 				post_chunk = chunk_min.tuple()
 				chunk = self.chunks[post_chunk] if post_chunk in self.chunks else None
-				if not post_chunk in ray.traversed:
-					ray.traversed.append(post_chunk)
+				ray.traversed.add(post_chunk)
+				chunks += 1
 
 			if chunk:
 				pos = math.floor(ray.pos)
 				mat = chunk.get_voxel(pos)
 				if mat:
-					# Call the material function and obtain the bounce amount, add it to the total number of bounces
-					# Normalize ray velocity after any changes to ensure the speed of light remains 1 and voxels aren't skipped or calculated twice
-					bounce = mat.function(ray, mat, data.settings)
-					ray.bounces += bounce
-					ray.life /= chunk.resolution + bounce * data.settings.lod_bounces
-					ray.vel = ray.vel.normalize()
-					if ray.step >= ray.life or ray.energy >= data.settings.max_light or ray.bounces >= data.settings.max_bounces + 1:
+					hits += 1
+					custom += mat.function is not material
+					if self.hit(ray, mat, chunk):
 						break
 
 					# Reflect the velocity of the ray based on material IOR and the neighbors of this voxel which are used to determine face normals
@@ -97,9 +667,9 @@ class Camera:
 						pos_x = math.floor(ray_pos_x)
 						pos_y = math.floor(ray_pos_y)
 						pos_z = math.floor(ray_pos_z)
-						chunk_x = chunk if ray_pos_x >= chunk_min and ray_pos_x <= chunk_max else self.chunk_get(ray_pos_x)
-						chunk_y = chunk if ray_pos_y >= chunk_min and ray_pos_y <= chunk_max else self.chunk_get(ray_pos_y)
-						chunk_z = chunk if ray_pos_z >= chunk_min and ray_pos_z <= chunk_max else self.chunk_get(ray_pos_z)
+						chunk_x = chunk if ray_pos_x.within(chunk_min, chunk_max) else self.chunk_get(ray_pos_x)
+						chunk_y = chunk if ray_pos_y.within(chunk_min, chunk_max) else self.chunk_get(ray_pos_y)
+						chunk_z = chunk if ray_pos_z.within(chunk_min, chunk_max) else self.chunk_get(ray_pos_z)
 						mat_x = chunk_x.get_voxel(pos_x) if chunk_x else None
 						mat_y = chunk_y.get_voxel(pos_y) if chunk_y else None
 						mat_z = chunk_z.get_voxel(pos_z) if chunk_z else None
@@ -110,23 +680,181 @@ class Camera:
 						if not mat_z or mat_z.ior != mat.ior:
 							ray.vel.z -= ray.vel.z * mat.ior * 2
 
-			# Advance the ray, move by frame LOD if inside a valid chunk or skip toward the safest possible distance to the nearest chunk if void
-			step = chunk.resolution if chunk else 1 + abs(data.settings.chunk_radius - (ray.pos.mins() + data.settings.chunk_radius) % data.settings.chunk_size)
-			ray.step += step
-			ray.pos += ray.vel * step
+			# Advance the ray, move by frame LOD if inside a valid chunk or leave the largest empty node of the tree if void
+			# If the ray is in an empty brick of the chunk, skip to the edge of the brick while moving at least as far as a normal step
+			# Chunks that exist but were culled from the camera are crossed toward the safest possible distance to the nearest chunk so they can be traversed
+			if chunk:
+				brick = None if mat else chunk.get_brick(pos)
+				step = max(chunk.resolution, self.area_exit(ray, brick)[0]) if brick else chunk.resolution
+				bricks += brick is not None
+			else:
+				voids += 1
+				area = self.tree.get_empty(ray.pos)
+				step = self.area_exit(ray, area)[0] + 0.001 if area else 1 + abs(data.settings.chunk_radius - (ray.pos.mins() + data.settings.chunk_radius) % data.settings.chunk_size)
+			ray.advance(step)
+		if data.stats:
+			self.march_stats(chunks, voids, bricks, hits, custom)
+		return steps
 
-		# Run the background function and return the ray data
-		if data.background:
-			data.background(ray, data.settings)
-		return ray
+	# Add the counters of a ray to the stats
+	def march_stats(self, chunks: int, voids: int, bricks: int, hits: int, custom: int):
+		data.stats.add("chunks", chunks)
+		data.stats.add("voids", voids)
+		data.stats.add("bricks", bricks)
+		data.stats.add("hits", hits)
+		data.stats.add("custom", custom)
 
-	# Called by threads with a tile image to paint to, creates a new surface for this thread to paint to which is returned to the main thread as a byte string
+	# Get the distance the ray needs to travel to leave an area such as a brick or tree node, as well as the axis of the face it leaves through
+	def area_exit(self, ray, post6: tuple):
+		pos = ray.pos
+		vel = ray.vel
+		dist_x = (post6[3] - pos.x) / vel.x if vel.x > 0 else (post6[0] - pos.x) / vel.x if vel.x < 0 else math.inf
+		dist_y = (post6[4] - pos.y) / vel.y if vel.y > 0 else (post6[1] - pos.y) / vel.y if vel.y < 0 else math.inf
+		dist_z = (post6[5] - pos.z) / vel.z if vel.z > 0 else (post6[2] - pos.z) / vel.z if vel.z < 0 else math.inf
+		if dist_x <= dist_y and dist_x <= dist_z:
+			return max(0, dist_x), 0
+		if dist_y <= dist_z:
+			return max(0, dist_y), 1
+		return max(0, dist_z), 2
+
+	# Calculate the distance the ray needs to travel to reach the next face of its cell on each axis, as well as the distance between two faces on each axis
+	def dda(self, ray, cell: list, unit: int):
+		t_max = [math.inf, math.inf, math.inf]
+		t_delta = [math.inf, math.inf, math.inf]
+		for axis, pos, vel in zip(range(3), ray.pos.array(), ray.vel.array()):
+			if vel > 0:
+				t_max[axis] = max(0, ((cell[axis] + 1) * unit - pos) / vel)
+				t_delta[axis] = unit / vel
+			elif vel < 0:
+				t_max[axis] = max(0, (cell[axis] * unit - pos) / vel)
+				t_delta[axis] = -unit / vel
+		return t_max, t_delta
+
+	# Exact grid traversal based on the Amanatides & Woo DDA algorithm, the ray moves to the next cell through the nearest face so every cell it crosses is visited once and corners can't be penetrated
+	# Cells are the size of the resolution of the chunk the traversal started in, it restarts with the new resolution after entering a chunk with a different LOD or skipping through the void
+	# The face the ray entered through is used as the normal for reflections, the velocity is reflected on that axis unless the previous cell has a material of the same IOR
+	# Empty bricks are crossed in a single step, the face the ray leaves the brick by becomes the entry face of the next cell
+	# Returns the number of steps preformed, counters are added to the stats once the ray finished
+	def march_dda(self, ray):
+		size = data.settings.chunk_size
+		unit = 0
+		post = None
+		steps = chunks = voids = bricks = hits = custom = 0
+		while ray.step < ray.life:
+			steps += 1
+			# Start a new traversal from the current position, the ray is nudged forward so positions on a face select the cell the ray is about to enter
+			if not unit:
+				pos = ray.pos + ray.vel.scaled(0.001)
+				chunk = self.chunk_get(pos)
+				unit = chunk.resolution if chunk else 1
+				cell = [math.floor(pos.x / unit), math.floor(pos.y / unit), math.floor(pos.z / unit)]
+				t_max, t_delta = self.dda(ray, cell, unit)
+				axis = -1
+				mat_prev = None
+
+			# Fetch the chunk containing the cell, restart the traversal if the chunk uses a different resolution
+			pos = vec3(cell[0] * unit, cell[1] * unit, cell[2] * unit)
+			post_chunk = pos.x // size * size, pos.y // size * size, pos.z // size * size
+			if post_chunk != post:
+				post = post_chunk
+				chunk = self.chunks[post] if post in self.chunks else None
+				ray.traversed.add(post)
+				chunks += 1
+				if chunk and chunk.resolution != unit and axis >= 0:
+					unit = 0
+					continue
+
+			# Leave the largest empty node of the tree if void, culled chunks are crossed toward the safest possible distance to the nearest chunk
+			if not chunk:
+				voids += 1
+				area = self.tree.get_empty(ray.pos + ray.vel.scaled(0.001))
+				step = self.area_exit(ray, area)[0] if area else 1 + abs(data.settings.chunk_radius - (ray.pos.mins() + data.settings.chunk_radius) % size)
+				ray.advance(step)
+				unit = 0
+				continue
+
+			# If the cell is in an empty brick move to the edge of the brick at once, the traversal continues from the cell entered through the face the ray left by
+			mat = chunk.get_voxel(pos)
+			brick = None if mat else chunk.get_brick(pos)
+			if brick:
+				bricks += 1
+				step, axis = self.area_exit(ray, brick)
+				if step == math.inf:
+					break
+				ray.advance(step)
+				pos = ray.pos + ray.vel.scaled(0.001)
+				cell = [math.floor(pos.x / unit), math.floor(pos.y / unit), math.floor(pos.z / unit)]
+				t_max, t_delta = self.dda(ray, cell, unit)
+				mat_prev = None
+				continue
+			if mat:
+				hits += 1
+				custom += mat.function is not material
+				if self.hit(ray, mat, chunk):
+					break
+				if mat.ior and axis >= 0 and (not mat_prev or mat_prev.ior != mat.ior):
+					match axis:
+						case 0:
+							ray.vel.x -= ray.vel.x * mat.ior * 2
+						case 1:
+							ray.vel.y -= ray.vel.y * mat.ior * 2
+						case 2:
+							ray.vel.z -= ray.vel.z * mat.ior * 2
+				t_max, t_delta = self.dda(ray, cell, unit)
+			mat_prev = mat
+
+			# Advance the ray to the nearest face and enter the next cell on that axis
+			axis = 0 if t_max[0] <= t_max[1] and t_max[0] <= t_max[2] else 1 if t_max[1] <= t_max[2] else 2
+			step = t_max[axis]
+			if step == math.inf:
+				break
+			ray.advance(step)
+			t_max[0] -= step
+			t_max[1] -= step
+			t_max[2] -= step
+			t_max[axis] += t_delta[axis]
+			cell[axis] += 1 if (ray.vel.x, ray.vel.y, ray.vel.z)[axis] > 0 else -1
+		if data.stats:
+			self.march_stats(chunks, voids, bricks, hits, custom)
+		return steps
+
+	# Called by threads to trace the work units assigned to them, the RGBA color of each pixel is packed in the order of the units and their pixels and returned to the main thread as a byte string
+	# The time spent tracing each unit is returned with the image, it's used by the main thread to balance units between threads
+	# If the shared framebuffer is enabled pixels are written to it directly and no image is returned
+	# The batch engine traces all units at once and splits its time between them based on the share of work done for each unit
+	# If stats are enabled the counters collected by this thread are returned and reset, they're added to those of the main thread
+	def tile(self, thread: int, units: list):
+		rays, steps = self.rays, self.steps
+		time_tile = time.perf_counter()
+		if self.batch:
+			image, traversed, costs = self.batch.tile(self, units)
+			time_total = time.perf_counter() - time_tile
+			costs = [cost * time_total for cost in costs]
+		else:
+			images = []
+			traversed = set()
+			costs = []
+			for unit in units:
+				time_start = time.perf_counter()
+				image, traversed_unit = self.tile_unit(unit)
+				costs.append(time.perf_counter() - time_start)
+				images.append(image)
+				traversed |= traversed_unit
+			image = b"".join(images) if self.framebuffer is None else None
+
+		if data.stats:
+			data.stats.add("rays", self.rays - rays)
+			data.stats.add("steps", self.steps - steps)
+			data.stats.add("time_trace", time.perf_counter() - time_tile)
+		return image, traversed, thread, units, costs, data.stats.reset() if data.stats else None
+
+	# Trace the pixels of a work unit and return the packed image, or None if the pixels were written to the shared framebuffer
 	# If static noise is enabled, the random seed is set to an index unique to this pixel and sample so noise in ray calculations is static instead of flickering
 	# The alpha channel is used for motion blur, ray energy is translated to transparency which simulates a shutter making bright pixels stronger
-	def tile(self, thread: int, t: int):
-		surface = pg.Surface(data.settings.window, pg.SRCALPHA)
-		traversed = []
-		for x, y in data.settings.pixels[thread]:
+	def tile_unit(self, unit: int):
+		image = bytearray()
+		traversed = set()
+		for x, y in data.settings.pixels[unit]:
 			colors = []
 			dir_x = -1 + (x / data.settings.width) * 2
 			dir_y = -1 + (y / data.settings.height) * 2
@@ -140,124 +868,302 @@ class Camera:
 				ray = self.trace(dir_x, dir_y, ray_detail)
 				alpha = round(min(1, ray.energy + data.settings.shutter) * 255)
 				colors.append(ray.color.array() + [alpha])
-				traversed = merge(traversed, ray.traversed)
+				traversed |= ray.traversed
 
 			color = average(colors)
-			surface.set_at((x, y), (color[0], color[1], color[2], color[3]))
+			if self.framebuffer is not None:
+				self.framebuffer[y, x] = color
+			else:
+				image.extend((math.trunc(color[0]), math.trunc(color[1]), math.trunc(color[2]), math.trunc(color[3])))
 			random.seed(None)
 
-		image = pg.image.tobytes(surface, "RGBA")
-		return image, traversed, thread
+		return bytes(image) if self.framebuffer is None else None, traversed
 
 # Window: Initializes Pygame and starts the main loop, handles all updates and redraws the canvas using a Camera instance
 class Window:
-	def __init__(self):
-		# Configure Pygame and the main screen as well as the camera and thread pool that will be used to update the window
+	def __init__(self, headless: bool = False):
+		# Configure Pygame and the main screen as well as the camera and render workers that will be used to update the window
+		# A headless window is driven by its caller such as the benchmark, it renders with its own camera and doesn't start render workers or the main loop
 		pg.init()
 		pg.display.set_caption("Voxel Tracer")
 		self.screen = pg.display.set_mode(data.settings.window_scaled)
 		self.canvas = pg.Surface(data.settings.window, pg.SRCALPHA)
 		self.font = pg.font.SysFont(None, 24)
 		self.clock = pg.time.Clock()
-		self.pool = mp.Pool(data.settings.threads)
 		self.cam = Camera()
 		self.chunks = {}
+		self.chunks_changed = {}
+		self.tree_changed = {}
+		self.materials_state = {}
 		self.chunks_objects = {}
 		self.timer = 0
+		self.physics_timer = 0
 		self.iris = self.iris_target = 0
 		self.mouselook = True
 		self.running = True
 		self.input_vel = vec3(0, 0, 0)
 		self.input_rot = vec3(0, 0, 0)
 		self.busy = [False] * data.settings.threads
-		self.traversed = [[]] * data.settings.threads
+		self.traversed = [[]] * data.settings.units
+		self.pixels = [np.array(pixels, dtype = np.int64).reshape(-1, 2) for pixels in data.settings.pixels]
+		self.units = [list(range(t, data.settings.units, data.settings.threads)) for t in range(data.settings.threads)]
+		self.units_queue = []
+		self.units_share = 0
+		self.costs = [0] * data.settings.units
+		self.workers = []
+
+		# If the scene cache is enabled, chunks built during the first chunk update are read from the cache if the objects touching them didn't change since the last launch
+		# Cached chunks are indexed by [key] and store the cells of each LOD, chunks built in this session are stored once the first chunk update finishes
+		self.chunks_sources = {}
+		self.chunks_cache = None
+		self.chunks_cache_new = {}
+		if data.cache_scene:
+			self.chunks_cache = data.cache_scene.get(("chunks", data.mod), (data.settings.chunk_size, data.settings.chunk_lod)) or {}
+		if headless:
+			if data.settings.batch:
+				self.cam.batch = Batch()
+			return
+
+		# If stats are enabled keep the totals of the current second for the overlay, counters of each frame are also written to the stats file if one is set
+		self.stats_total = counters()
+		self.stats_timer = 0
+		self.stats_text = []
+		self.stats_file = open(data.settings.stats_file, "wt") if data.stats and data.settings.stats_file else None
+
+		# Buffers used by post-processing are allocated once and reused every frame, arrays hold RGBA values indexed by [x][y] with room for values outside the 0 - 255 range
+		# Surfaces are allocated at the size of each scaling step, sizes are truncated the same way Pygame does when scaling by a factor
+		self.post = np.zeros((data.settings.width, data.settings.height, 4), dtype = np.int32)
+		self.post_mask = np.zeros((data.settings.width, data.settings.height, 4), dtype = np.int32)
+		self.post_gray = np.zeros((data.settings.width, data.settings.height), dtype = np.float64)
+		self.post_gray_channel = np.zeros((data.settings.width, data.settings.height), dtype = np.float64)
+		self.post_canvas = pg.Surface(data.settings.window, pg.SRCALPHA)
+		self.post_bloom = pg.Surface((round(data.settings.window[0] / max(1, data.settings.bloom_blur)), round(data.settings.window[1] / max(1, data.settings.bloom_blur))), pg.SRCALPHA)
+		size = data.settings.window
+		if data.settings.subsamples:
+			size = math.trunc(size[0] * (1 + data.settings.subsamples)), math.trunc(size[1] * (1 + data.settings.subsamples))
+			self.post_subsample = pg.Surface(size, pg.SRCALPHA)
+		if data.settings.smooth != 0 and data.settings.smooth != 1:
+			size = size[0] * math.trunc(1 / data.settings.smooth), size[1] * math.trunc(1 / data.settings.smooth)
+			self.post_sharp = pg.Surface(size, pg.SRCALPHA)
+		self.post_scaled = pg.Surface(data.settings.window_scaled, pg.SRCALPHA)
+
+		# If enabled allocate the shared framebuffer, workers attach to it by name so it's shared with any process start method
+		self.framebuffer_memory = None
+		if data.settings.shared:
+			self.framebuffer_memory = mp.shared_memory.SharedMemory(create = True, size = data.settings.width * data.settings.height * 4)
+
+		# Start one render worker per thread, each worker gets a pipe to receive messages while results are collected from a shared queue
+		self.results = mp.Queue()
+		for t in range(data.settings.threads):
+			pipe_main, pipe_worker = mp.Pipe()
+			process = mp.Process(target = self.cam.work, args = (t, pipe_worker, self.results, self.framebuffer_memory.name if self.framebuffer_memory else None), daemon = True)
+			process.start()
+			self.workers.append((process, pipe_main))
+		if self.framebuffer_memory:
+			self.cam.framebuffer = np.ndarray((data.settings.height, data.settings.width, 4), dtype = np.uint8, buffer = self.framebuffer_memory.buf)
 
 		# Main loop limited by FPS
 		while self.running:
 			self.clock.tick(data.settings.fps)
 			self.update()
 			if not self.running:
-				self.pool.close()
-				self.pool.join()
+				# Keep reading results while waiting for workers to exit, a worker can't finish until the tiles it queued were flushed
+				self.send(("exit",), range(len(self.workers)))
+				for process, pipe in self.workers:
+					while process.is_alive():
+						try:
+							self.results.get(timeout = 0.1)
+						except queue.Empty:
+							pass
+					process.join()
+				if self.framebuffer_memory:
+					self.cam.framebuffer = None
+					self.framebuffer_memory.close()
+					self.framebuffer_memory.unlink()
+				if self.stats_file:
+					self.stats_file.close()
 				exit
 
-	# Called by the thread pool on finish, adds the image to the appropriate thread for the main thread to mix
+	# Pickle a message once and send it to the render workers with the given indexes
+	def send(self, msg: tuple, threads):
+		msg_bytes = pickle.dumps(msg)
+		for t in threads:
+			self.workers[t][1].send_bytes(msg_bytes)
+
+	# Called by the main thread when a worker returned a result, the packed pixels of the thread are mixed into the canvas at once
+	# Pixels are alpha blended over the existing canvas the same way Pygame blits them, the alpha of older pixels is combined with new ones for motion blur
+	# With the shared framebuffer the result only signals that the thread finished, its pixels are read from the framebuffer before the thread is given a new tile
 	def draw_tile(self, result):
-		image, traversed, thread = result
-		surface = pg.image.frombytes(image, data.settings.window, "RGBA")
-		self.canvas.blit(surface, (0, 0))
-		self.traversed[thread] = traversed
+		image, traversed, thread, units, costs, stats = result
+		if stats:
+			data.stats.merge(stats)
+		pixels = np.concatenate([self.pixels[u] for u in units])
+		x, y = pixels[:, 0], pixels[:, 1]
+		if image is None:
+			src = self.cam.framebuffer[y, x].astype(np.int32)
+		else:
+			src = np.frombuffer(image, dtype = np.uint8).reshape(-1, 4).astype(np.int32)
+		canvas_rgb = pg.surfarray.pixels3d(self.canvas)
+		canvas_alpha = pg.surfarray.pixels_alpha(self.canvas)
+		dst = canvas_rgb[x, y].astype(np.int32)
+		dst_alpha = canvas_alpha[x, y].astype(np.int32)
+		src_alpha = src[:, 3]
+		blend = (((src[:, :3] - dst) * src_alpha[:, None] + src[:, :3]) >> 8) + dst
+		canvas_rgb[x, y] = np.where(dst_alpha[:, None] > 0, blend, src[:, :3])
+		canvas_alpha[x, y] = np.where(dst_alpha > 0, src_alpha + dst_alpha - src_alpha * dst_alpha // 255, src_alpha)
+		del canvas_rgb, canvas_alpha
+		for u in units:
+			self.traversed[u] = traversed
 		self.busy[thread] = False
+		for u, cost in zip(units, costs):
+			self.costs[u] = cost
+
+	# Give the given idle threads new work units from a queue of units that weren't traced yet in this pass, based on the time each unit took to trace the last time it was drawn
+	# A pass queues every unit in order of decreasing cost, units are taken by the idle thread with the lowest total cost so far or the fewest units if costs are equal
+	# Each thread takes units until it holds its share of the cost of the pass, threads that finish early come back for more units so fast threads trace more of the pass than slow ones
+	# Units still traced by busy threads are left out of a new pass so no unit is traced twice at once, returns the threads that received units
+	def balance(self, threads: list):
+		loads = {t: 0 for t in threads}
+		for t in threads:
+			self.units[t] = []
+		for refill in (False, True):
+			if not self.units_queue:
+				busy = unpack(self.units)
+				self.units_queue = sorted([u for u in range(data.settings.units) if not u in busy], key = lambda u: self.costs[u], reverse = True)
+				self.units_share = sum(self.costs[u] for u in self.units_queue) / len(self.busy)
+			while self.units_queue:
+				t = min(threads, key = lambda t: (loads[t], len(self.units[t])))
+				if self.units[t] and loads[t] >= self.units_share:
+					break
+				u = self.units_queue.pop(0)
+				self.units[t].append(u)
+				loads[t] += self.costs[u]
+			if self.units_queue or all(self.units[t] for t in threads):
+				break
+		return [t for t in threads if self.units[t]]
 
 	# Request the camera to draw a new tile for each thread
 	def draw(self):
+		# Collect the tiles of workers that finished since the last call
+		while True:
+			try:
+				self.draw_tile(self.results.get_nowait())
+			except queue.Empty:
+				break
+
 		# If sync is enabled, skip updates until all tiles have finished
 		if data.settings.sync:
 			for t in range(len(self.busy)):
 				if self.busy[t]:
 					return
 
-		# Start render threads that aren't busy
-		update = False
-		for t in range(len(self.busy)):
-			if not self.busy[t]:
-				self.busy[t] = update = True
-				self.pool.apply_async(self.cam.tile, args = (t, 0), callback = self.draw_tile)
+		# Give render workers that aren't busy new work units and send them the camera pose
+		threads = [t for t in range(len(self.busy)) if not self.busy[t]]
+		update = len(threads) > 0
+		if threads and data.settings.balance > 1:
+			threads = self.balance(threads)
+		if threads:
+			for t in threads:
+				self.busy[t] = True
+			self.send(("draw", self.cam.pos, self.cam.rot, self.cam.lens, self.units), threads)
 
 		# Redraw the canvas if at least one thread produced a new pixel set
 		if update:
+			time_start = data.stats.start() if data.stats else 0
+
+			# Copy the canvas to the post-processing array which holds the RGBA values of each pixel indexed by [x][y], effects are applied to the array the same way Pygame blends surfaces
+			# Values are saturated to the 0 - 255 range after each step, multiplying two colors is done as (a * b + 255) >> 8 like BLEND_RGBA_MULT
+			post = self.post
+			canvas_rgb = pg.surfarray.pixels3d(self.canvas)
+			canvas_alpha = pg.surfarray.pixels_alpha(self.canvas)
+			post[:, :, :3] = canvas_rgb
+			post[:, :, 3] = canvas_alpha
+			del canvas_rgb, canvas_alpha
+
 			# Color spill: Multiply the canvas with its average color
-			canvas = pg.Surface.copy(self.canvas)
-			color = pg.transform.average_color(canvas, consider_alpha = True)
+			color = pg.transform.average_color(self.canvas, consider_alpha = True)
 			if data.settings.spill:
 				fac = 255 - round(data.settings.spill * 255)
 				color_tint = min(255, color[0] + fac), min(255, color[1] + fac), min(255, color[2] + fac), min(255, color[3] + fac)
-				canvas.fill(color_tint, special_flags = pg.BLEND_RGBA_MULT)
+				post *= color_tint
+				post += 255
+				post >>= 8
 
 			# Iris adaptation: Brighten or darken the canvas in contrast to its luminosity, a grayscale copy is added or subtracted, the mask is inverted based on the operation
+			# The luminosity of each pixel is summed into the gray buffer one channel at a time and truncated like Pygame's grayscale
 			if data.settings.iris and data.settings.iris_time:
-				col = 0 if self.iris > 0 else 255
-				mod = pg.BLEND_RGBA_ADD if self.iris > 0 else pg.BLEND_RGBA_SUB
 				fac = round(abs(self.iris * 255))
-				canvas_gray = pg.transform.grayscale(canvas)
-				canvas_mask = pg.Surface(data.settings.window, pg.SRCALPHA)
-				canvas_mask.fill((col, col, col, col), special_flags = 0)
-				canvas_mask.blit(canvas_gray, (0, 0), special_flags = mod)
-				canvas_mask.fill((fac, fac, fac, fac), special_flags = pg.BLEND_RGBA_MULT)
-				canvas.blit(canvas_mask, (0, 0), special_flags = mod)
+				mask = self.post_mask
+				gray = self.post_gray
+				channel = self.post_gray_channel
+				np.multiply(post[:, :, 0], 0.299, out = gray)
+				np.multiply(post[:, :, 1], 0.587, out = channel)
+				gray += channel
+				np.multiply(post[:, :, 2], 0.114, out = channel)
+				gray += channel
+				np.copyto(mask[:, :, 0], gray, casting = "unsafe")
+				mask[:, :, 1] = mask[:, :, 0]
+				mask[:, :, 2] = mask[:, :, 0]
+				mask[:, :, 3] = post[:, :, 3]
+				if self.iris <= 0:
+					np.subtract(255, mask, out = mask)
+				mask *= fac
+				mask += 255
+				mask >>= 8
+				if self.iris > 0:
+					post += mask
+				else:
+					post -= mask
+				np.clip(post, 0, 255, out = post)
 				self.iris_target = 1 - (max(color[0], color[1], color[2]) / 255) * 2
 
-			# Bloom: Duplicate the canvas, darken the copy to adjust intensity, downscale then upscale to blur, lighten the canvas with the result
+			# Bloom: Darken a copy of the canvas to adjust intensity, downscale then upscale it to blur, lighten the canvas with the result
+			# The copy is darkened on all channels so its alpha is always 0, only the color of the blurred copy is added
 			if data.settings.bloom and data.settings.bloom_blur:
-				box = round(data.settings.window[0] / max(1, data.settings.bloom_blur)), round(data.settings.window[1] / max(1, data.settings.bloom_blur))
 				fac = round((1 - data.settings.bloom) * 255)
-				canvas_blur = pg.Surface.copy(canvas)
-				canvas_blur.fill((fac, fac, fac), special_flags = pg.BLEND_RGBA_SUB)
-				canvas_blur = pg.transform.smoothscale(canvas_blur, box)
-				canvas_blur = pg.transform.smoothscale(canvas_blur, data.settings.window)
-				canvas.blit(canvas_blur, (0, 0), special_flags = pg.BLEND_RGBA_ADD)
+				blur_rgb = pg.surfarray.pixels3d(self.post_canvas)
+				blur_alpha = pg.surfarray.pixels_alpha(self.post_canvas)
+				np.subtract(post[:, :, :3], fac, out = self.post_mask[:, :, :3])
+				np.maximum(self.post_mask[:, :, :3], 0, out = blur_rgb, casting = "unsafe")
+				blur_alpha[:] = 0
+				del blur_rgb, blur_alpha
+				pg.transform.smoothscale(self.post_canvas, self.post_bloom.get_size(), self.post_bloom)
+				pg.transform.smoothscale(self.post_bloom, data.settings.window, self.post_canvas)
+				post[:, :, :3] += pg.surfarray.pixels3d(self.post_canvas)
+				np.minimum(post, 255, out = post)
+
+			# Write the array to the surface used for scaling
+			canvas = self.post_canvas
+			canvas_rgb = pg.surfarray.pixels3d(canvas)
+			canvas_alpha = pg.surfarray.pixels_alpha(canvas)
+			canvas_rgb[:] = post[:, :, :3]
+			canvas_alpha[:] = post[:, :, 3]
+			del canvas_rgb, canvas_alpha
 
 			# Subsampling: Smoothly scale the canvas by the subsample amount to create extra pixels
 			if data.settings.subsamples:
-				fac = 1 + data.settings.subsamples
-				canvas = pg.transform.smoothscale_by(canvas, (fac, fac))
+				canvas = pg.transform.smoothscale(canvas, self.post_subsample.get_size(), self.post_subsample)
 
 			# Filter: Scale the canvas to the window size using the desired type of pixel smoothness, for gradual pixel hardness the canvas is first scaled sharply and then smoothly
 			if data.settings.smooth == 0:
-				canvas = pg.transform.scale(canvas, data.settings.window_scaled)
+				canvas = pg.transform.scale(canvas, data.settings.window_scaled, self.post_scaled)
 			elif data.settings.smooth == 1:
-				canvas = pg.transform.smoothscale(canvas, data.settings.window_scaled)
+				canvas = pg.transform.smoothscale(canvas, data.settings.window_scaled, self.post_scaled)
 			else:
-				fac = math.trunc(1 / data.settings.smooth)
-				canvas = pg.transform.scale_by(canvas, (fac, fac))
-				canvas = pg.transform.smoothscale(canvas, data.settings.window_scaled)
+				canvas = pg.transform.scale(canvas, self.post_sharp.get_size(), self.post_sharp)
+				canvas = pg.transform.smoothscale(canvas, data.settings.window_scaled, self.post_scaled)
 
 			# Add the info text to the canvas, blit the canvas to the screen, update Pygame display
 			text_info = str(data.settings.width) + " x " + str(data.settings.height) + " (" + str(data.settings.width * data.settings.height) + "px) - " + str(math.trunc(self.clock.get_fps())) + " / " + str(data.settings.fps) + " FPS"
 			text = self.font.render(text_info, True, (255, 255, 255))
 			self.screen.blit(canvas, (0, 0))
 			self.screen.blit(text, (0, 0))
+			for i, text_stats in enumerate(self.stats_text):
+				text = self.font.render(text_stats, True, (255, 255, 255))
+				self.screen.blit(text, (0, 24 * (1 + i)))
 			pg.display.flip()
+			if data.stats:
+				data.stats.stop("time_post", time_start)
 
 	# Handle keyboard and mouse input, apply object movement and rotation for the main object
 	def input(self, time: float):
@@ -390,66 +1296,133 @@ class Window:
 		self.timer += time
 		if self.timer >= data.settings.chunk_time:
 			self.timer -= max(data.settings.chunk_time, time)
+			time_start = data.stats.start() if data.stats else 0
 			traversed = unpack(self.traversed)
 
-			# Recalculate the frames of objects that require visual update, chunks that need to be updated are set to None
-			# An object's existing chunks are removed if the object was deleted or will be updated, new ones are then added if the object is visible
-			# Frames in object chunks are indexed by [object_id][position_chunk]
+			# Recalculate the voxels of objects that require visual update, chunks whose contents changed are set to None to be rebuilt
+			# The rotated voxels of the object's sprite are cached by the sprite, moving the object only offsets them by its minimum corner
+			# An object's existing chunks are compared with its new ones, chunks the object left or no longer changes are only rebuilt if their voxels differ
+			# Voxels in object chunks are indexed by [object_id][position_chunk][position]
 			for obj_id in merge(data.objects.keys(), self.chunks_objects.keys()):
-				if obj_id in self.chunks_objects and (not obj_id in data.objects or data.objects[obj_id].redraw):
-					for post_chunk in self.chunks_objects[obj_id]:
-						self.chunks[post_chunk] = None
-					del self.chunks_objects[obj_id]
-				if obj_id in data.objects and data.objects[obj_id].redraw and data.objects[obj_id].visible:
-					obj = data.objects[obj_id]
+				obj = data.objects[obj_id] if obj_id in data.objects else None
+				if obj and not obj.redraw:
+					continue
+
+				chunks_old = self.chunks_objects.pop(obj_id, {})
+				chunks_new = {}
+				self.chunks_sources.pop(obj_id, None)
+				if obj and obj.visible:
 					obj.redraw = False
 					spr = obj.get_sprite()
-					chunk_min = obj.mins.snapped(data.settings.chunk_size)
-					chunk_max = obj.maxs.snapped(data.settings.chunk_size)
-					for chunk_x in range(chunk_min.x, chunk_max.x + 1, data.settings.chunk_size):
-						for chunk_y in range(chunk_min.y, chunk_max.y + 1, data.settings.chunk_size):
-							for chunk_z in range(chunk_min.z, chunk_max.z + 1, data.settings.chunk_size):
-								voxels = {}
-								pos_min = obj.mins.max(vec3(chunk_x, chunk_y, chunk_z))
-								pos_max = obj.maxs.min(vec3(chunk_x + data.settings.chunk_size, chunk_y + data.settings.chunk_size, chunk_z + data.settings.chunk_size))
-								post_chunk = chunk_x, chunk_y, chunk_z
-								self.chunks[post_chunk] = None
-								for x in range(pos_min.x, pos_max.x):
-									for y in range(pos_min.y, pos_max.y):
-										for z in range(pos_min.z, pos_max.z):
-											pos = vec3(x, y, z)
-											mat = spr.get_voxel(None, pos - obj.mins, obj.rot)
-											if mat:
-												post = x, y, z
-												voxels[post] = mat
-								if voxels:
-									if not obj_id in self.chunks_objects:
-										self.chunks_objects[obj_id] = {}
-									self.chunks_objects[obj_id][post_chunk] = data.Frame(packed = True, resolution = 1)
-									self.chunks_objects[obj_id][post_chunk].set_voxels(voxels, True)
+					size = obj.maxs - obj.mins
+					source = spr.get_frame(None).source
+					if source:
+						self.chunks_sources[obj_id] = (source[0], round(obj.rot.x / 90) % 4, round(obj.rot.y / 90) % 4, round(obj.rot.z / 90) % 4, obj.mins.tuple(), size.tuple()), source[1]
+					for post, mat in spr.get_voxels_rotated(None, obj.rot).items():
+						if post[0] < size.x and post[1] < size.y and post[2] < size.z:
+							x, y, z = obj.mins.x + post[0], obj.mins.y + post[1], obj.mins.z + post[2]
+							post_chunk = x // data.settings.chunk_size * data.settings.chunk_size, y // data.settings.chunk_size * data.settings.chunk_size, z // data.settings.chunk_size * data.settings.chunk_size
+							if not post_chunk in chunks_new:
+								chunks_new[post_chunk] = {}
+							chunks_new[post_chunk][(x, y, z)] = mat
+					if chunks_new:
+						self.chunks_objects[obj_id] = chunks_new
+
+				for post_chunk in merge(chunks_old.keys(), chunks_new.keys()):
+					if chunks_old.get(post_chunk) != chunks_new.get(post_chunk):
+						self.chunks[post_chunk] = None
 
 			# Empty chunks were marked for recalculation, remove and create new frames from the combined voxels lists of all chunk if any voxel data is available
 			# Valid chunks are sent to the camera for rendering if a chunk is visible or occlusion culling is disabled
 			# Frames in chunks are indexed by [position_chunk][lod]
+			# Chunks found in the scene cache have their cells copied instead of being built from voxels
 			for post_chunk in list(self.chunks.keys()):
 				if not self.chunks[post_chunk]:
+					key, mats = self.chunk_cache_key(post_chunk)
+					cached = self.chunks_cache.get(key) if key else None
 					voxels = {}
-					for obj in self.chunks_objects.values():
-						if post_chunk in obj:
-							voxels |= obj[post_chunk].get_voxels()
-					if voxels:
+					if not cached:
+						for obj in self.chunks_objects.values():
+							if post_chunk in obj:
+								voxels |= obj[post_chunk]
+					if cached or voxels:
+						if data.stats and not cached:
+							data.stats.add("chunk_rebuilds")
 						self.chunks[post_chunk] = [None] * (data.settings.chunk_lod + 1)
 						for lod in range(data.settings.chunk_lod + 1):
-							self.chunks[post_chunk][lod] = data.Frame(packed = True, resolution = lod + 1)
-							self.chunks[post_chunk][lod].set_voxels(voxels, True)
+							self.chunks[post_chunk][lod] = data.Chunk(pos = vec3(post_chunk[0], post_chunk[1], post_chunk[2]), size = data.settings.chunk_size, resolution = lod + 1)
+							if cached:
+								self.chunks[post_chunk][lod].cache_set(cached[lod], mats)
+							else:
+								self.chunks[post_chunk][lod].set_voxels(voxels, True)
+						if key:
+							cached = [chunk.cache_get(mats) for chunk in self.chunks[post_chunk]]
+							if all(cached):
+								self.chunks_cache_new[key] = cached
 					else:
 						del self.chunks[post_chunk]
 				if post_chunk in self.chunks and (not data.settings.culling or post_chunk in traversed):
 					pos = vec3(post_chunk[0], post_chunk[1], post_chunk[2]) + data.settings.chunk_radius
 					lod = min(math.trunc(pos.distance(self.cam.pos) / (data.settings.dist_max / (1 + data.settings.chunk_lod))), data.settings.chunk_lod)
-					self.cam.chunk_set(post_chunk, self.chunks[post_chunk][lod])
+					self.chunk_set(post_chunk, self.chunks[post_chunk][lod])
 				else:
-					self.cam.chunk_set(post_chunk, None)
+					self.chunk_set(post_chunk, None)
+				self.tree_set(post_chunk, post_chunk in self.chunks)
+
+			# Send the chunks and tree positions that were added replaced or removed to the render workers
+			if self.chunks_changed:
+				self.send(("chunks", self.chunks_changed), range(len(self.workers)))
+				self.chunks_changed = {}
+			if self.tree_changed:
+				self.send(("tree", self.tree_changed), range(len(self.workers)))
+				self.tree_changed = {}
+
+			# Send materials whose properties changed since the last update to the render workers, materials are compared by their pickled data
+			materials = list(data.materials.values())
+			materials_state = {mat.id: pickle.dumps(mat) for mat in materials}
+			materials_changed = [mat for mat in materials if self.materials_state.get(mat.id, materials_state[mat.id]) != materials_state[mat.id]]
+			if materials_changed:
+				self.send(("materials", materials_changed), range(len(self.workers)))
+			self.materials_state = materials_state
+
+			# Once the first chunks were built store them in the scene cache, chunks are no longer cached after this
+			if self.chunks_cache is not None and self.chunks_cache_new:
+				data.cache_scene.set(("chunks", data.mod), (data.settings.chunk_size, data.settings.chunk_lod), self.chunks_cache_new)
+				self.chunks_cache = None
+				self.chunks_cache_new = {}
+			if data.stats:
+				data.stats.stop("time_chunk_update", time_start)
+
+	# Get the key describing the content of a chunk in the scene cache from the objects touching it, as well as the list of materials its cells are stored with
+	# The key contains the source of each object's sprite frame as well as its rotation position and size in order, the materials are those of each sprite's palette
+	# Materials that are the same instance in multiple palettes are included in the key, returns None if caching is disabled or an object's sprite wasn't loaded from a file
+	def chunk_cache_key(self, post: tuple):
+		if self.chunks_cache is None:
+			return None, None
+		sources = []
+		mats = []
+		for obj_id, chunks in self.chunks_objects.items():
+			if post in chunks:
+				if not obj_id in self.chunks_sources:
+					return None, None
+				sources.append(self.chunks_sources[obj_id][0])
+				mats += self.chunks_sources[obj_id][1]
+		index = {}
+		for i, mat in enumerate(mats):
+			index.setdefault(id(mat), i)
+		return (post, tuple(sources), tuple(index[id(mat)] for mat in mats)), mats
+
+	# Assign a chunk frame to the camera, frames that differ from the ones the camera already has are queued for the render workers
+	def chunk_set(self, post: tuple, chunk):
+		if self.cam.chunks.get(post) is not chunk:
+			self.cam.chunk_set(post, chunk)
+			self.chunks_changed[post] = chunk
+
+	# Add or remove a chunk position from the tree of the camera, positions that changed are queued for the render workers
+	def tree_set(self, post: tuple, active: bool):
+		if self.cam.tree.get(post) != active:
+			self.cam.tree_set(post, active)
+			self.tree_changed[post] = active
 
 	# Main loop of the Pygame window, apply input then execute the update functions of objects in the scene and request redrawing when the window is focused
 	def update(self):
@@ -465,10 +1438,59 @@ class Window:
 			self.cam.rot = data.player.cam_rot
 			self.draw()
 			self.chunk_update(time)
+			if data.stats:
+				self.stats_update(time)
 			pg.mouse.set_visible(not self.mouselook)
 		for obj in data.objects.values():
 			obj.update(self.cam.pos)
+		self.physics_update(time)
 		self.input(time)
 
-# Create the main window and start Pygame
-Window()
+	# Run physics at a fixed rate independent of the frame rate, each tick updates active physics objects that aren't sleeping
+	# Sleeping objects whose velocity changed since they fell asleep are woken, velocity may be set directly instead of through accelerate
+	# The number of ticks per frame is limited so a slow frame doesn't cause more work in the next one, the remaining time is dropped which slows physics down instead
+	def physics_update(self, time: float):
+		time_start = data.stats.start() if data.stats else 0
+		tick = 1 / data.settings.tick
+		ticks = 0
+		self.physics_timer += time
+		while self.physics_timer >= tick and ticks < data.settings.tick_max:
+			self.physics_timer -= tick
+			ticks += 1
+			for obj in list(data.objects.values()):
+				if obj.physics and obj.active:
+					if obj.sleeping and obj.vel != obj.vel_sleep:
+						obj.sleeping = False
+					if not obj.sleeping:
+						obj.update_physics()
+		self.physics_timer = min(self.physics_timer, tick)
+		if data.stats:
+			data.stats.stop("time_physics", time_start)
+
+	# Collect the counters of the last frame including those returned by render workers, write them to the stats file if one is set
+	# Once per second the totals are averaged per frame and ray to produce the lines of text shown below the frame rate, times are shown in milliseconds
+	def stats_update(self, time: float):
+		items = data.stats.reset()
+		items["frames"] = 1
+		items["time_frame"] = time
+		if self.stats_file:
+			self.stats_file.write(json.dumps(items) + "\n")
+		self.stats_total.merge(items)
+		self.stats_timer += time
+		if self.stats_timer >= 1:
+			self.stats_timer = 0
+			total = self.stats_total.reset()
+			frames = total["frames"]
+			rays = max(1, total.get("rays", 0))
+			per_ray = lambda name: str(round(total.get(name, 0) / rays, 2))
+			per_frame = lambda name: str(round(total.get(name, 0) * 1000 / frames, 2))
+			self.stats_text = [
+				str(round(total.get("rays", 0) / frames)) + " rays - " + per_ray("steps") + " steps - " + per_ray("hits") + " hits - " + per_ray("custom") + " custom per ray",
+				per_ray("chunks") + " chunks - " + per_ray("voids") + " voids - " + per_ray("bricks") + " bricks per ray",
+				per_frame("time_trace") + " trace - " + per_frame("time_post") + " post - " + per_frame("time_chunk_update") + " chunks (" + str(total.get("chunk_rebuilds", 0)) + " rebuilt) ms per frame",
+				per_frame("time_pack") + " pack - " + per_frame("time_unpack") + " unpack - " + per_frame("time_physics") + " physics ms per frame",
+			]
+
+# Create the main window and start Pygame, the file can also be imported without starting the window
+if __name__ == "__main__":
+	Window()
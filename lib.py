@@ -1,7 +1,11 @@
 #!/usr/bin/python3
 import sys
+import os
 import math
+import time
 import random
+import hashlib
+import pickle
 
 # Store: Generic data storage, similar to the Python dictionary but allows getting and setting properties with dots (eg: data.prop instead of data["prop"])
 class store:
@@ -9,6 +13,140 @@ class store:
 		for a in args:
 			setattr(self, a, args[a])
 
+# Ray: State of a light ray traced by the camera, holds the same properties a data store would but uses slots for faster access
+# Material functions can read and replace any property and may still add custom ones, chunks traversed by the ray are collected in a set
+class raydata:
+	__slots__ = "color", "energy", "pos", "vel", "step", "life", "bounces", "traversed", "__dict__"
+
+	def __init__(self, color, energy: float, pos, vel, step: float, life: float, bounces: float, traversed: set):
+		self.color = color
+		self.energy = energy
+		self.pos = pos
+		self.vel = vel
+		self.step = step
+		self.life = life
+		self.bounces = bounces
+		self.traversed = traversed
+
+	# Move the ray by its velocity multiplied by the given distance, the position is changed in place to avoid allocating new vectors each step
+	def advance(self, step: float):
+		self.pos.iadd_scaled(self.vel, step)
+		self.step += step
+
+# Counters: Named counters and timers which can be increased and combined with the counters of other processes, timers store an amount of seconds
+class counters:
+	def __init__(self):
+		self.items = {}
+
+	# Add an amount to a counter, counters that don't exist start from 0
+	def add(self, name: str, amount = 1):
+		self.items[name] = self.items.get(name, 0) + amount
+
+	# Add all counters from a dictionary, typically obtained from another process
+	def merge(self, items: dict):
+		for name, amount in items.items():
+			self.add(name, amount)
+
+	# Get the current time to start a timer, the seconds passed since then are added to a timer by stop
+	def start(self):
+		return time.perf_counter()
+
+	def stop(self, name: str, start: float):
+		self.add(name, time.perf_counter() - start)
+
+	# Return the current counters and start again from 0
+	def reset(self):
+		items = self.items
+		self.items = {}
+		return items
+
+# Cache: Stores processed data on disk so it doesn't need to be calculated again on the next launch, items are stored as pickled files in the given directory
+# Each item is identified by a name and stored with a key describing its content such as the hash of its source, an item whose key changed is stale and ignored until it's replaced
+class cache:
+	version = 1
+
+	def __init__(self, **settings):
+		self.path = settings["path"] if "path" in settings else "cache"
+		os.makedirs(self.path, exist_ok = True)
+
+	# Get the file an item is stored in, the name can be any value that has a stable representation
+	def get_file(self, name):
+		return os.path.join(self.path, hashlib.sha1(repr(name).encode()).hexdigest() + ".pickle")
+
+	# Get the value of an item, returns None if the item doesn't exist or its key doesn't match
+	def get(self, name, key):
+		try:
+			with open(self.get_file(name), "rb") as file:
+				version, key_file, value = pickle.load(file)
+		except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+			return None
+		return value if version == self.version and key_file == key else None
+
+	# Store the value of an item replacing the existing one, the file is written under another name first so other processes never read a partial file
+	def set(self, name, key, value):
+		file = self.get_file(name)
+		with open(file + "." + str(os.getpid()), "wb") as file_temp:
+			pickle.dump((self.version, key, value), file_temp)
+		os.replace(file + "." + str(os.getpid()), file)
+
+# Box grid: A uniform grid indexing the boxes of items by the cells they touch, used to find the items near an area without checking all of them
+# Boxes are provided in the same format as data6 with the min and max corners both included, cells hold the items touching them and are indexed by [position_cell][item]
+# Each item is numbered in the order it was added so items near an area are always returned in the same order
+class boxgrid:
+	def __init__(self, **settings):
+		self.size = settings["size"] if "size" in settings else 1
+		self.cells = {}
+		self.items = {}
+		self.order = {}
+		self.count = 0
+
+	# Get the range of cells touched by a box in the same format as the box
+	def get_range(self, post6: tuple):
+		return post6[0] // self.size, post6[1] // self.size, post6[2] // self.size, post6[3] // self.size, post6[4] // self.size, post6[5] // self.size
+
+	# Get the positions of all cells in a range
+	def get_cells(self, range6: tuple):
+		cells = set()
+		for x in range(range6[0], range6[3] + 1):
+			for y in range(range6[1], range6[4] + 1):
+				for z in range(range6[2], range6[5] + 1):
+					cells.add((x, y, z))
+		return cells
+
+	# Add, move or remove an item, None removes the item from the grid
+	# Nothing is done if the item remains in the same cells, otherwise only the cells it entered or left are changed
+	def set(self, item, post6: tuple):
+		range_old = self.items[item] if item in self.items else None
+		range_new = self.get_range(post6) if post6 else None
+		if range_new == range_old:
+			return
+		cells_old = self.get_cells(range_old) if range_old else set()
+		cells_new = self.get_cells(range_new) if range_new else set()
+		for post in cells_old - cells_new:
+			self.cells[post].remove(item)
+			if not self.cells[post]:
+				del self.cells[post]
+		for post in cells_new - cells_old:
+			if not post in self.cells:
+				self.cells[post] = set()
+			self.cells[post].add(item)
+		if range_new:
+			if not range_old:
+				self.order[item] = self.count
+				self.count += 1
+			self.items[item] = range_new
+		else:
+			del self.items[item]
+			del self.order[item]
+
+	# Get the items in the cells touched by a box in the order they were added, items may be near the box without intersecting it
+	def get(self, post6: tuple):
+		result = set()
+		for post in self.get_cells(self.get_range(post6)):
+			if post in self.cells:
+				result |= self.cells[post]
+		return sorted(result, key = self.order.get)
+
 # Vector2: A 2D vector containing X, Y directions, typically used for pixel positions in screen
 class vec2:
 	__slots__ = "x", "y"
@@ -270,6 +408,19 @@ class vec3:
 	def __str__(self):
 		return str(self.x) + "," + str(self.y) + "," + str(self.z)
 
+	# Fast paths for hot loops: Scalar and vector specific operations skip type checks, iadd_scaled modifies this vector and returns it instead of allocating a new one
+	def scaled(self, amount: float):
+		return vec3(self.x * amount, self.y * amount, self.z * amount)
+
+	def iadd_scaled(self, other, amount: float):
+		self.x += other.x * amount
+		self.y += other.y * amount
+		self.z += other.z * amount
+		return self
+
+	def within(self, pos_min, pos_max):
+		return pos_min.x <= self.x <= pos_max.x and pos_min.y <= self.y <= pos_max.y and pos_min.z <= self.z <= pos_max.z
+
 	def array(self):
 		return [self.x, self.y, self.z]
 
@@ -308,9 +459,9 @@ class vec3:
 		return vec3((self.x + other.x) % 360, (self.y + other.y) % 360, (self.z + other.z) % 360)
 
 	def normalize(self):
-		ref = abs(self).maxs()
+		ref = max(abs(self.x), abs(self.y), abs(self.z))
 		if ref and ref != 1:
-			return vec3(self.x, self.y, self.z) / ref
+			return vec3(self.x / ref, self.y / ref, self.z / ref)
 		return self
 
 	def snapped(self, unit):
@@ -415,6 +566,25 @@ def unpack(items: list):
 		result += item
 	return result
 
+# Join items that repeat on consecutive coordinates of the same layer into spans, items are provided in lists indexed by [(layer, coordinate)]
+# Returns a list of (layer, item, coordinate_min, coordinate_max)
+def spans(items: dict):
+	result = []
+	active = {}
+	for layer, coord in sorted(items):
+		for item in items[(layer, coord)]:
+			key = layer, item
+			span = active.get(key)
+			if span and span[1] == coord - 1:
+				active[key] = span[0], coord
+			else:
+				if span:
+					result.append((layer, item, span[0], span[1]))
+				active[key] = coord, coord
+	for (layer, item), span in active.items():
+		result.append((layer, item, span[0], span[1]))
+	return result
+
 # Returns the average result from a list of equal length
 def average(items):
 	if len(items[0]) <= 1: